@@ -0,0 +1,223 @@
+"""Times the interpreter's phases on the benchmark scripts and compares them
+against a saved baseline. Scripts with a recorded output in `expected/` must
+still print exactly that, in the timed runs, at every optimization level, on
+every backend and with every loop compiled on the stack backend.
+
+    python3 benchmarks/run.py [scripts...] [--repeat N] [--output results.json]
+                              [--baseline baseline.json] [--save-baseline]
+                              [--backend stack|register|compiled] [--no-tiering]
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from memo import Memoizer
+from loop_compiler import LoopCompiler
+from output import OutputWriter
+from linker import link
+from parsing import parse
+from tokenization import tokenize
+from vm import VM
+from register_vm import RegisterVM
+from compiled_vm import CompiledVM
+import optimizer
+
+PHASES = ['tokenize', 'parse', 'optimize', 'run']
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+EXPECTED_DIR = os.path.join(BENCHMARKS_DIR, 'expected')
+BACKENDS = {'register': RegisterVM, 'compiled': CompiledVM}
+# Scripts timed without memoization: fib times calls, which the memo cache would
+# answer after the first one of each argument.
+UNMEMOIZED = {'fib'}
+# Report keys that must match the baseline's for the timings to be comparable.
+CONFIGURATION = ['optimize_level', 'memoize', 'unmemoized', 'backend', 'tiering']
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+# Besides the timed runs, each script with an expected output is run once in each
+# of these, by name and `run_once` arguments, so that an optimizer pass, a backend
+# or a compiled loop that changes what a script prints fails the run.
+CHECKS = ([(f'-O{level}', {'optimize_level': level}) for level in (0, 1, 2)] +
+          [(f'--backend {backend}', {'backend': backend}) for backend in BACKENDS] +
+          [('--tier-threshold 1', {'tier_threshold': 1})])
+
+def run_once(source: str, optimize_level: int=2, memoize: bool=True, backend: str='stack',
+             tiering: bool=True, tier_threshold: int=1000):
+    timings = {}
+    tokens, timings['tokenize'] = timed(tokenize, source)
+    # Linking is part of the parse phase, to keep the baseline's phases comparable.
+    func_decls, timings['parse'] = timed(lambda: link(parse(tokens)))
+    _, timings['optimize'] = timed(optimizer.optimize, func_decls, optimize_level)
+    output = io.StringIO()
+    if backend in BACKENDS:
+        # Compiling to register code or Python counts as part of the run.
+        _, timings['run'] = timed(lambda: BACKENDS[backend](func_decls, OutputWriter(output)).run())
+    else:
+        memoizer = Memoizer(func_decls) if memoize else None
+        loop_compiler = LoopCompiler(func_decls, tier_threshold) if tiering else None
+        vm = VM(func_decls, output=OutputWriter(output), memoizer=memoizer, loop_compiler=loop_compiler)
+        _, timings['run'] = timed(vm.run)
+    return timings, output.getvalue()
+
+def expected_name(path: str):
+    return os.path.splitext(os.path.basename(path))[0] + '.out'
+
+def expected_output(path: str):
+    """The output recorded for a script in `expected/`, or None."""
+    expected_path = os.path.join(EXPECTED_DIR, expected_name(path))
+    if not os.path.exists(expected_path):
+        return None
+    with open(expected_path) as file:
+        return file.read()
+
+def output_matches(path: str, outputs: set):
+    """Compares a script's output with the one recorded in `expected/`, if there is
+    one, so changes to the interpreter can't silently change what scripts print."""
+    expected = expected_output(path)
+    return expected is None or all(output == expected for output in outputs)
+
+# Scripts whose output didn't match their expected output.
+mismatches = []
+
+def benchmark(path: str, repeat: int, optimize_level: int, memoize: bool, backend: str,
+              tiering: bool):
+    with open(path) as file:
+        source = file.read()
+    runs = {phase: [] for phase in PHASES}
+    outputs = set()
+    for _ in range(repeat):
+        timings, output = run_once(source, optimize_level, memoize, backend, tiering)
+        outputs.add(output)
+        for phase in PHASES:
+            runs[phase].append(timings[phase])
+    if len(outputs) != 1:
+        print(f"warning: {os.path.basename(path)} printed different output across runs.", file=sys.stderr)
+    if not output_matches(path, outputs):
+        print(f"error: {os.path.basename(path)} printed something other than " +
+              f"expected/{expected_name(path)}.", file=sys.stderr)
+        mismatches.append(path)
+    return {
+        phase: {"min": min(times), "median": statistics.median(times), "runs": times}
+        for phase, times in runs.items()
+    }
+
+def check(path: str):
+    """Runs a script with an expected output once in each of `CHECKS`."""
+    expected = expected_output(path)
+    if expected is None:
+        return
+    with open(path) as file:
+        source = file.read()
+    for name, options in CHECKS:
+        _, output = run_once(source, **options)
+        if output != expected:
+            print(f"error: {os.path.basename(path)} printed something other than " +
+                  f"expected/{expected_name(path)} with {name}.", file=sys.stderr)
+            mismatches.append(path)
+
+def compare(report: dict, baseline: dict, threshold: float):
+    """Prints current/baseline ratios of the fastest runs and returns the regressions,
+    or None if the baseline was recorded with a different configuration."""
+    differences = [key for key in CONFIGURATION if report[key] != baseline.get(key)]
+    if differences:
+        print("error: the baseline was recorded with " +
+              ', '.join(f'{key} {baseline.get(key)!r}, not {report[key]!r}' for key in differences) +
+              "; run with its settings or record a new baseline with --save-baseline.", file=sys.stderr)
+        return None
+    results, baseline = report["results"], baseline["results"]
+    regressions = []
+    print(f"\n{'benchmark':<24}{'phase':<10}{'baseline':>10}{'current':>10}{'ratio':>8}")
+    for name, phases in results.items():
+        if name not in baseline:
+            continue
+        for phase in PHASES:
+            before = baseline[name][phase]["min"]
+            after = phases[phase]["min"]
+            ratio = after / before if before > 0 else 1.0
+            flag = ''
+            # Phases that take a few milliseconds are too noisy to call regressions.
+            if ratio > 1 + threshold and after - before > 0.005:
+                flag = '  REGRESSION'
+                regressions.append((name, phase, ratio))
+            print(f"{name:<24}{phase:<10}{before:>10.4f}{after:>10.4f}{ratio:>8.2f}{flag}")
+    return regressions
+
+def arg_parser():
+    parser = argparse.ArgumentParser(prog='run.py')
+    parser.add_argument('scripts', nargs='*',
+                        help='benchmark scripts (default: every .txt file in benchmarks/)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('-O', type=int, default=2, choices=[0, 1, 2], dest='optimize_level')
+    parser.add_argument('--no-memo', action='store_true',
+                        help="don't cache the return values of pure functions")
+    parser.add_argument('--backend', choices=['stack', 'register', 'compiled'], default='stack')
+    parser.add_argument('--no-tiering', action='store_true',
+                        help="don't compile hot loops on the stack backend")
+    parser.add_argument('--output', metavar='PATH', help='write the results as JSON to PATH')
+    parser.add_argument('--baseline', metavar='PATH', default=DEFAULT_BASELINE,
+                        help='results to compare against (default: benchmarks/baseline.json)')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store these results as the new baseline instead of comparing')
+    parser.add_argument('--threshold', type=float, default=0.20,
+                        help='slowdown ratio above which a phase counts as a regression (default: 0.20)')
+    return parser
+
+def main():
+    args = arg_parser().parse_args()
+    scripts = args.scripts or sorted(glob.glob(os.path.join(BENCHMARKS_DIR, '*.txt')))
+
+    results = {}
+    print(f"{'benchmark':<24}" + ''.join(f'{phase:>10}' for phase in PHASES))
+    for path in scripts:
+        name = os.path.splitext(os.path.basename(path))[0]
+        memoize = not args.no_memo and name not in UNMEMOIZED
+        results[name] = benchmark(path, args.repeat, args.optimize_level, memoize, args.backend,
+                                  not args.no_tiering)
+        print(f"{name:<24}" + ''.join(f'{results[name][phase]["min"]:>10.4f}' for phase in PHASES))
+        check(path)
+
+    report = {
+        "python": platform.python_version(),
+        "optimize_level": args.optimize_level,
+        # Only the stack backend memoizes.
+        "memoize": args.backend == 'stack' and not args.no_memo,
+        "unmemoized": sorted(UNMEMOIZED),
+        "backend": args.backend,
+        "tiering": args.backend == 'stack' and not args.no_tiering,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=4)
+
+    if mismatches:
+        return 1
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(report, file, indent=4)
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions is None or regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""Caches a script's parsed bytecode in `<script>.bytecode`, next to the script.
+
+The cache is JSON holding only names, opcodes and their operands, so loading a
+file can't run any Python code. It is still trusted to hold the bytecode of the
+source whose hash it records. Anyone who can write to the script's directory can
+therefore change what the script does, though only within the language. Run with
+`--no-cache` where that directory isn't trusted.
+"""
+from instructions import OpCode
+from parsing import FunctionDeclaration, parse
+from tokenization import tokenize_stream
+import hashlib
+import json
+
+# Bump whenever the bytecode layout changes (opcodes, operands, FunctionDeclaration
+# fields) so that stale cache files are rebuilt instead of loaded.
+FORMAT_VERSION = 9
+
+OPCODES = {opcode.value: opcode for opcode in OpCode}
+
+def cache_path(script_path: str):
+    return script_path + '.bytecode'
+
+def source_key(source: str):
+    return hashlib.sha256(source.encode()).hexdigest()
+
+def encode(func_decl: FunctionDeclaration) -> dict:
+    code_segment = func_decl.code_segment
+    return {
+        'name': func_decl.name,
+        'params': func_decl.params,
+        'local_names': func_decl.local_names,
+        'code_segment': code_segment,
+        # JSON writes opcodes as ints; their positions tell them from int operands.
+        'opcodes': [position for position, item in enumerate(code_segment) if type(item) is OpCode],
+    }
+
+def decode(entry: dict) -> FunctionDeclaration:
+    code_segment = entry['code_segment']
+    for position in entry['opcodes']:
+        code_segment[position] = OPCODES[code_segment[position]]
+    return FunctionDeclaration(entry['name'], entry['params'], code_segment, entry['local_names'])
+
+def load(path: str, key: str):
+    try:
+        with open(path, encoding='utf-8') as file:
+            cached = json.load(file)
+        if cached['version'] != FORMAT_VERSION or cached['key'] != key:
+            return None
+        function_declarations = [decode(entry) for entry in cached['functions']]
+    except Exception:
+        # Missing, truncated or foreign files are all just cache misses.
+        return None
+    return {func_decl.name: func_decl for func_decl in function_declarations}
+
+def store(path: str, key: str, function_declarations: dict):
+    cached = {
+        'version': FORMAT_VERSION,
+        'key': key,
+        'functions': [encode(func_decl) for func_decl in function_declarations.values()],
+    }
+    try:
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(cached, file, separators=(',', ':'))
+    except OSError:
+        pass
+
+def compile_source(script_path: str, source: str, use_cache=True, rebuild=False):
+    """Returns the function declarations for `source`, reading them from and writing
+    them to the cache file next to `script_path` unless `use_cache` is off."""
+    if not use_cache:
+        return parse(tokenize_stream(source))
+
+    path = cache_path(script_path)
+    key = source_key(source)
+    if not rebuild:
+        function_declarations = load(path, key)
+        if function_declarations is not None:
+            return function_declarations
+
+    function_declarations = parse(tokenize_stream(source))
+    store(path, key, function_declarations)
+    return function_declarations
@@ -0,0 +1,657 @@
+import math
+import sys
+import time
+from instructions import OpCode
+from output import OutputWriter
+from register_vm import RegOp, RegisterFunction, compile_functions
+from values import ListValue, display, is_number, type_name
+from vm import UNDEFINED, COMPARISONS, copy_template, add, sub, mul, div, mod, negate
+
+# Each function's register code is turned into the source of a Python function,
+# with the registers as Python locals and the jumps recovered as `if`s and
+# `while` loops, and the whole script is compiled with `compile()` in one go.
+
+# File name of the generated code, which marks its frames in tracebacks.
+FILENAME = '<compiled>'
+
+CONDITIONAL_JUMPS = {RegOp.JUMP_FALSE, RegOp.JUMP_TRUE, RegOp.COMPARE_JUMP}
+BRANCHES = CONDITIONAL_JUMPS | {RegOp.JUMP}
+TERMINATORS = BRANCHES | {RegOp.RET, RegOp.TAIL_CALL, RegOp.EXIT}
+NUMBER_TYPES = (int, float)
+
+ARITHMETIC = {
+    RegOp.ADD: ('+', 'add'),
+    RegOp.SUB: ('-', 'sub'),
+    RegOp.MUL: ('*', 'mul'),
+}
+# Python operator and generated-code name of each comparison function.
+COMPARISON_SOURCE = {
+    COMPARISONS[OpCode.GREATER]:       ('>', 'greater'),
+    COMPARISONS[OpCode.GREATER_EQUAL]: ('>=', 'greater_equal'),
+    COMPARISONS[OpCode.LESS]:          ('<', 'less'),
+    COMPARISONS[OpCode.LESS_EQUAL]:    ('<=', 'less_equal'),
+}
+
+
+def walk(list_obj, indices: tuple, name: str):
+    """Walks `indices` into `list_obj`. Returns the innermost list and the last
+    index, raising the stack VM's errors on the way."""
+    last = len(indices) - 1
+    for position, index in enumerate(indices):
+        if not isinstance(list_obj, ListValue):
+            raise RuntimeError(f"Can't subscript expression " +
+                               f"of type `{type_name(list_obj)}`")
+        if type(index) is not int:
+            if type(index) is not float:
+                raise RuntimeError(f"Can't use exression of type `{type_name(index)}` " +
+                                   f"to subscript `{name}`.")
+            index = int(index)
+        items = list_obj.items
+        if index >= len(items) or index < 0:
+            raise RuntimeError(f"Index `{index}` out of bounds " +
+                               f"for list of length `{len(items)}`.")
+        if position != last:
+            list_obj = items[index]
+    return list_obj, index
+
+# Slow paths called by the generated code when its inline checks fail.
+
+def load_subscript(list_obj, indices: tuple, name: str):
+    list_obj, index = walk(list_obj, indices, name)
+    return list_obj.items[index]
+
+def store_subscript(list_obj, indices: tuple, value, name: str):
+    list_obj, index = walk(list_obj, indices, name)
+    list_obj.set(index, value)
+
+def append(list_obj, value):
+    if not isinstance(list_obj, ListValue):
+        raise RuntimeError(f"Can't subscript expression " +
+                           f"of type `{type_name(list_obj)}`")
+    list_obj.append(value)
+
+def logical_not(operand):
+    raise RuntimeError(f"Can't logic negate instance of type `{type_name(operand)}`.")
+
+def condition_error(condition):
+    raise RuntimeError(f"Condition can't be of type `{type_name(condition)}`.")
+
+def undefined_variable(name: str):
+    raise RuntimeError(f"Undefined variable `{name}`.")
+
+
+class _Block:
+    """A basic block of register code: `code[start:end]`."""
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+        self.successors = []
+        self.predecessors = []
+
+
+class FunctionGenerator:
+    """Writes the Python source of one function.
+
+    Control flow is recovered from the dominator tree of the basic blocks, as in
+    Ramsey's "Beyond Relooper": every loop header becomes a `while True:` and
+    every block with more than one forward predecessor follows the code that
+    dominates it. Branches to where control would go anyway are left out;
+    the others become `continue`, `break`, or, when they leave more than one
+    loop, a `_goto` variable checked after each loop.
+    """
+    def __init__(self, function: RegisterFunction, names: dict, constants: dict, lines: list, line_pcs: list):
+        self.function = function
+        self.code = function.code
+        self.names = names
+        self.constants = constants
+        self.lines = lines
+        self.line_pcs = line_pcs
+        self.pc = 0
+        self.uses_goto = False
+
+    # Registers and constants
+
+    def is_constant(self, register: int) -> bool:
+        return len(self.function.local_names) <= register < self.function.temp_base
+
+    def reg(self, register: int) -> str:
+        if self.is_constant(register):
+            return self.literal(self.function.template[register])
+        return f'r{register}'
+
+    def literal(self, value) -> str:
+        if value is None or type(value) in (bool, str):
+            return repr(value)
+        if type(value) is float and not math.isfinite(value):
+            return self.constant(value)
+        return f'({value!r})' if value < 0 else repr(value)
+
+    def constant(self, value) -> str:
+        """A generated-code global holding `value`."""
+        name = f'k{len(self.constants)}'
+        self.constants[name] = value
+        return name
+
+    def value_type(self, register: int):
+        """The type of the value in `register` if it is known, else None. Here only
+        constants have known types."""
+        if self.is_constant(register):
+            return type(self.function.template[register])
+        return None
+
+    def number_checks(self, *registers):
+        """The conditions under which `registers` all hold numbers: registers not
+        known to hold one are checked for ints. None if one of them is known to
+        hold something else."""
+        checks = []
+        for register in registers:
+            kind = self.value_type(register)
+            if kind is None:
+                checks.append(f'type({self.reg(register)}) is int')
+            elif kind not in NUMBER_TYPES:
+                return None
+        return checks
+
+    def arithmetic_checks(self, a: int, b: int, ints: bool=True):
+        """The conditions under which `a` and `b` hold two ints, or two floats: mixed
+        operands, and with `ints` off ints at all, can overflow converting to float
+        and are left to the slow path. Registers whose type isn't known are checked
+        for the other one's, or for ints. None if the checks can't pass."""
+        kinds = {self.value_type(a), self.value_type(b)} - {None}
+        if len(kinds) > 1:
+            return None
+        kind = kinds.pop() if kinds else int if ints else float
+        if kind not in NUMBER_TYPES or kind is int and not ints:
+            return None
+        return [f'type({self.reg(register)}) is {kind.__name__}'
+                for register in (a, b) if self.value_type(register) is None]
+
+    def fast_path(self, fast: str, checks, slow: str) -> str:
+        if checks is None:
+            return slow
+        if not checks:
+            return fast
+        return f"{fast} if {' and '.join(checks)} else {slow}"
+
+    # Output
+
+    def line(self, indent: int, text: str):
+        self.lines.append('    ' * indent + text)
+        self.line_pcs.append((self.function, self.pc))
+
+    # Control flow graph
+
+    def build_blocks(self):
+        code = self.code
+        leaders = {0}
+        for pc, ins in enumerate(code):
+            if ins[0] in TERMINATORS:
+                leaders.add(pc + 1)
+                if ins[0] in BRANCHES:
+                    leaders.add(ins[-1] if ins[0] != RegOp.JUMP else ins[1])
+        starts = sorted(leader for leader in leaders if leader < len(code))
+        self.blocks = [_Block(start, end) for start, end in zip(starts, starts[1:] + [len(code)])]
+        self.block_at = {block.start: block for block in self.blocks}
+        for block in self.blocks:
+            for target in self.branch_targets(block):
+                successor = self.block_at[target]
+                block.successors.append(successor)
+                successor.predecessors.append(block)
+
+    def branch_targets(self, block: _Block):
+        """The pcs `block` continues at: for conditional jumps, where it goes when
+        the condition holds first."""
+        ins = self.code[block.end - 1]
+        op = ins[0]
+        if op == RegOp.JUMP:
+            return [ins[1]]
+        if op == RegOp.JUMP_FALSE or op == RegOp.COMPARE_JUMP:
+            return [block.end, ins[-1]]
+        if op == RegOp.JUMP_TRUE:
+            return [ins[2], block.end]
+        if op == RegOp.TAIL_CALL:
+            # A tail call to the function itself starts it over.
+            return [0] if ins[1] is self.function else []
+        if op == RegOp.RET or op == RegOp.EXIT:
+            return []
+        return [block.end]
+
+    def number_blocks(self):
+        # Reverse postorder, so every forward edge goes to a higher number.
+        order = []
+        visited = set()
+        stack = [(self.blocks[0], iter(self.blocks[0].successors))]
+        visited.add(id(self.blocks[0]))
+        while stack:
+            block, successors = stack[-1]
+            for successor in successors:
+                if id(successor) not in visited:
+                    visited.add(id(successor))
+                    stack.append((successor, iter(successor.successors)))
+                    break
+            else:
+                order.append(block)
+                stack.pop()
+        order.reverse()
+        for number, block in enumerate(order):
+            block.rpo = number
+        self.order = order
+
+    def find_dominators(self):
+        # Cooper, Harvey and Kennedy's iterative algorithm.
+        entry = self.order[0]
+        entry.idom = entry
+        for block in self.order[1:]:
+            block.idom = None
+        changed = True
+        while changed:
+            changed = False
+            for block in self.order[1:]:
+                new_idom = None
+                for predecessor in block.predecessors:
+                    if not hasattr(predecessor, 'rpo') or predecessor.idom is None:
+                        continue
+                    new_idom = predecessor if new_idom is None else self.intersect(predecessor, new_idom)
+                if new_idom is not block.idom:
+                    block.idom = new_idom
+                    changed = True
+
+        for block in self.order:
+            block.children = []
+            block.is_loop_header = False
+        for block in self.order[1:]:
+            block.idom.children.append(block)
+        for block in self.order:
+            forward = 0
+            for predecessor in block.predecessors:
+                if not hasattr(predecessor, 'rpo'):
+                    continue
+                if predecessor.rpo >= block.rpo:
+                    if not self.dominates(block, predecessor):
+                        raise ValueError(f"Can't compile `{self.function.name}`: irreducible control flow.")
+                    block.is_loop_header = True
+                else:
+                    forward += 1
+            block.is_merge = forward >= 2
+
+    @staticmethod
+    def intersect(a: _Block, b: _Block) -> _Block:
+        while a is not b:
+            while a.rpo > b.rpo:
+                a = a.idom
+            while b.rpo > a.rpo:
+                b = b.idom
+        return a
+
+    @staticmethod
+    def dominates(a: _Block, b: _Block) -> bool:
+        while b is not a:
+            if b.idom is b:
+                return False
+            b = b.idom
+        return True
+
+    # Structure: lists of ('code', block), ('br', block), ('if', block, then, else),
+    # ('loop', block, body) and ('block', block, body), where a 'block' is always
+    # followed by the code of its block.
+
+    def do_tree(self, block: _Block) -> list:
+        merges = sorted((child for child in block.children if child.is_merge),
+                        key=lambda child: child.rpo, reverse=True)
+        body = self.node_within(block, merges)
+        if block.is_loop_header:
+            return [('loop', block, body)]
+        return body
+
+    def node_within(self, block: _Block, merges: list) -> list:
+        if merges:
+            follower = merges[0]
+            return [('block', follower, self.node_within(block, merges[1:]))] + self.do_tree(follower)
+        statements = [('code', block)]
+        successors = block.successors
+        if self.code[block.end - 1][0] in CONDITIONAL_JUMPS:
+            statements.append(('if', block, self.do_branch(block, successors[0]),
+                               self.do_branch(block, successors[1])))
+        elif successors:
+            statements.extend(self.do_branch(block, successors[0]))
+        return statements
+
+    def do_branch(self, source: _Block, target: _Block) -> list:
+        if target.rpo <= source.rpo or target.is_merge:
+            return [('br', target)]
+        return self.do_tree(target)
+
+    @classmethod
+    def escapes(cls, statements: list, follow, label) -> bool:
+        """Whether `statements` branch to `label` from somewhere control doesn't
+        reach it by falling through."""
+        last = len(statements) - 1
+        for index, statement in enumerate(statements):
+            after = follow if index == last else None
+            kind = statement[0]
+            if kind == 'br' and statement[1] is label and after is not label:
+                return True
+            if kind == 'if' and (cls.escapes(statement[2], after, label) or
+                                 cls.escapes(statement[3], after, label)):
+                return True
+            if kind in ('loop', 'block') and cls.escapes(statement[2], statement[1], label):
+                return True
+        return False
+
+    # Emission. `follow` is the block control reaches by falling off the end of
+    # the statements; `loops` lists the enclosing Python loops as dicts, innermost last.
+
+    def emit_statements(self, statements: list, follow, loops: list, indent: int):
+        last = len(statements) - 1
+        for index, statement in enumerate(statements):
+            after = follow if index == last else None
+            kind = statement[0]
+            if kind == 'code':
+                self.emit_block(statement[1], loops, indent)
+            elif kind == 'br':
+                self.emit_branch(statement[1], after, loops, indent)
+            elif kind == 'if':
+                self.emit_if(statement, after, loops, indent)
+            elif kind == 'loop':
+                header = statement[1]
+                self.emit_loop({'continue': header, 'break': after, 'pending': []},
+                               statement[2], header, after, loops, indent)
+            elif self.escapes(statement[2], statement[1], statement[1]):
+                follower = statement[1]
+                self.emit_loop({'continue': None, 'break': follower, 'pending': []},
+                               statement[2], follower, follower, loops, indent)
+            else:
+                self.emit_statements(statement[2], statement[1], loops, indent)
+
+    def emit_body(self, statements: list, follow, loops: list, indent: int):
+        start = len(self.lines)
+        self.emit_statements(statements, follow, loops, indent)
+        if len(self.lines) == start:
+            self.line(indent, 'pass')
+
+    def emit_loop(self, loop: dict, body: list, body_follow, after, loops: list, indent: int):
+        self.line(indent, 'while True:')
+        self.emit_body(body, body_follow, loops + [loop], indent + 1)
+        if loop['continue'] is None:
+            # A block: falling off its end leaves it.
+            self.line(indent + 1, 'break')
+        for target in loop['pending']:
+            self.line(indent, f'if _goto == {target.start}:')
+            self.emit_branch(target, after, loops, indent + 1, from_goto=True)
+
+    def emit_branch(self, target: _Block, follow, loops: list, indent: int, from_goto=False):
+        if target is not follow and loops:
+            loop = loops[-1]
+            if loop['continue'] is target or loop['break'] is target:
+                if from_goto:
+                    self.line(indent, '_goto = None')
+                self.line(indent, 'continue' if loop['continue'] is target else 'break')
+            else:
+                self.uses_goto = True
+                if not from_goto:
+                    self.line(indent, f'_goto = {target.start}')
+                self.line(indent, 'break')
+                if target not in loop['pending']:
+                    loop['pending'].append(target)
+        elif from_goto:
+            self.line(indent, '_goto = None')
+
+    def emit_if(self, statement, follow, loops: list, indent: int, keyword='if'):
+        _, block, then_branch, else_branch = statement
+        ins = self.code[block.end - 1]
+        self.pc = block.end - 1
+        op = ins[0]
+        if op == RegOp.COMPARE_JUMP:
+            self.line(indent, f'{keyword} {self.comparison(ins[1], ins[2], ins[3])}:')
+            self.emit_body(then_branch, follow, loops, indent + 1)
+        elif self.value_type(ins[1]) is bool:
+            self.line(indent, f'{keyword} {self.reg(ins[1])}:')
+            self.emit_body(then_branch, follow, loops, indent + 1)
+        elif self.is_constant(ins[1]):
+            # A constant that isn't a bool always fails; testing a literal with `is`
+            # would also make Python warn.
+            self.line(indent, f'{keyword} condition_error({self.reg(ins[1])}):')
+            self.emit_body(then_branch, follow, loops, indent + 1)
+        else:
+            condition = self.reg(ins[1])
+            # Successors put the branch taken when the condition holds first.
+            self.line(indent, f'{keyword} {condition} is True:')
+            self.emit_body(then_branch, follow, loops, indent + 1)
+            self.pc = block.end - 1
+            self.line(indent, f'elif {condition} is not False:')
+            self.line(indent + 1, f'condition_error({condition})')
+        if (len(else_branch) == 2 and else_branch[1][0] == 'if' and
+                else_branch[0][1].start == else_branch[0][1].end - 1):
+            # `else if` chains whose conditions need no code of their own stay flat.
+            self.emit_if(else_branch[1], follow, loops, indent, 'elif')
+            return
+        self.pc = block.end - 1
+        self.line(indent, 'else:')
+        self.emit_body(else_branch, follow, loops, indent + 1)
+
+    def comparison(self, function, a: int, b: int) -> str:
+        if function is COMPARISONS[OpCode.EQUAL_EQUAL]:
+            return f'{self.reg(a)} == {self.reg(b)}'
+        symbol, name = COMPARISON_SOURCE[function]
+        return self.fast_path(f'{self.reg(a)} {symbol} {self.reg(b)}', self.number_checks(a, b),
+                              f'{name}({self.reg(a)}, {self.reg(b)})')
+
+    def emit_block(self, block: _Block, loops: list, indent: int):
+        for pc in range(block.start, block.end):
+            self.pc = pc
+            ins = self.code[pc]
+            if ins[0] not in BRANCHES:
+                self.emit_instruction(ins, indent)
+
+    def emit_instruction(self, ins: tuple, indent: int):
+        op = ins[0]
+        reg = self.reg
+        if op == RegOp.MOVE:
+            self.line(indent, f'{reg(ins[1])} = {reg(ins[2])}')
+        elif op in ARITHMETIC:
+            symbol, name = ARITHMETIC[op]
+            a, b = reg(ins[2]), reg(ins[3])
+            checks = self.arithmetic_checks(ins[2], ins[3])
+            if op == RegOp.ADD and self.value_type(ins[2]) is str and self.value_type(ins[3]) is str:
+                checks = []
+            self.line(indent, f'{reg(ins[1])} = ' + self.fast_path(f'{a} {symbol} {b}', checks, f'{name}({a}, {b})'))
+        elif op == RegOp.DIV or op == RegOp.MODULO:
+            symbol, name = ('/', 'div') if op == RegOp.DIV else ('%', 'mod')
+            a, b = reg(ins[2]), reg(ins[3])
+            checks = self.arithmetic_checks(ins[2], ins[3], ints=op == RegOp.MODULO)
+            # Division by zero is reported by the slow path.
+            if checks is not None and not self.is_constant(ins[3]):
+                checks.append(b)
+            elif checks is not None and not self.function.template[ins[3]]:
+                checks = None
+            self.line(indent, f'{reg(ins[1])} = ' + self.fast_path(f'{a} {symbol} {b}', checks, f'{name}({a}, {b})'))
+        elif op == RegOp.COMPARE:
+            self.line(indent, f'{reg(ins[1])} = {self.comparison(ins[4], ins[2], ins[3])}')
+        elif op == RegOp.NEGATE:
+            a = reg(ins[2])
+            self.line(indent, f'{reg(ins[1])} = ' + self.fast_path(f'-{a}', self.number_checks(ins[2]), f'negate({a})'))
+        elif op == RegOp.NOT:
+            a = reg(ins[2])
+            if self.value_type(ins[2]) is bool:
+                self.line(indent, f'{reg(ins[1])} = not {a}')
+            else:
+                self.line(indent, f'{reg(ins[1])} = not {a} if type({a}) is bool else logical_not({a})')
+        elif op == RegOp.LIST:
+            self.line(indent, f"{reg(ins[1])} = ListValue([{', '.join(map(reg, ins[2]))}])")
+        elif op == RegOp.LIST_CONST:
+            self.line(indent, f'{reg(ins[1])} = copy_template({self.constant(ins[2])})')
+        elif op == RegOp.LOAD_SUBSCRIPT:
+            checks, innermost, index = self.subscript_checks(ins[2], ins[3])
+            name = repr(ins[4])
+            slow = f'load_subscript({reg(ins[2])}, ({self.index_tuple(ins[3])}), {name})'
+            self.line(indent, f'{reg(ins[1])} = {innermost}.items[{index}] if {checks} else {slow}')
+        elif op == RegOp.STORE_SUBSCRIPT:
+            checks, innermost, index = self.subscript_checks(ins[1], ins[2])
+            name = repr(ins[4])
+            self.line(indent, f'if {checks}: {innermost}.set({index}, {reg(ins[3])})')
+            self.line(indent, f'else: store_subscript({reg(ins[1])}, ({self.index_tuple(ins[2])}), {reg(ins[3])}, {name})')
+        elif op == RegOp.APPEND:
+            self.line(indent, f'append({reg(ins[1])}, {reg(ins[2])})')
+        elif op == RegOp.PRINT:
+            self.line(indent, f'write(display({reg(ins[1])}))')
+        elif op == RegOp.PRINTLN:
+            self.line(indent, f'write(display({reg(ins[1])}) + "\\n")')
+        elif op == RegOp.SLEEP:
+            self.line(indent, f'sleep({reg(ins[1])})')
+        elif op == RegOp.CLRSCRN:
+            self.line(indent, 'clear_screen()')
+        elif op == RegOp.CHECK_DEFINED:
+            if self.value_type(ins[1]) is not None:
+                return
+            self.line(indent, f'if r{ins[1]} is UNDEFINED: undefined_variable({ins[2]!r})')
+        elif op == RegOp.CALL:
+            self.line(indent, f"{reg(ins[1])} = {self.names[ins[2].name]}({', '.join(map(reg, ins[3]))})")
+        elif op == RegOp.CALL_NATIVE:
+            native = self.constant(ins[2].function)
+            self.line(indent, f"{reg(ins[1])} = {native}(vm, [{', '.join(map(reg, ins[3]))}])")
+        elif op == RegOp.TAIL_CALL:
+            args = ', '.join(map(reg, ins[2]))
+            if ins[1] is not self.function:
+                self.line(indent, f'return {self.names[ins[1].name]}({args})')
+                return
+            # Starts the function over in the same Python frame; the branch back
+            # to the entry follows.
+            if ins[2]:
+                params = ', '.join(f'r{slot}' for slot in range(len(ins[2])))
+                self.line(indent, f'{params} = {args}')
+            others = [f'r{slot}' for slot in range(self.function.param_count, len(self.function.local_names))]
+            if others:
+                self.line(indent, f"{' = '.join(others)} = UNDEFINED")
+        elif op == RegOp.RET:
+            self.line(indent, f'return {reg(ins[1])}')
+        else:
+            raise ValueError(f"Can't compile `{op.name}` to Python.")
+
+    def subscript_checks(self, slot: int, indices: tuple):
+        """The conditions under which `indices` index into the lists in `slot`
+        without an error, the innermost list and the last index."""
+        checks = []
+        innermost = f'r{slot}'
+        for position, register in enumerate(indices):
+            index = self.reg(register)
+            if position != 0 or self.value_type(slot) is not ListValue:
+                checks.append(f'type({innermost}) is ListValue')
+            if self.value_type(register) is not int:
+                checks.append(f'type({index}) is int')
+            checks.append(f'0 <= {index} < len({innermost}.items)')
+            if position != len(indices) - 1:
+                row = f'_row{position}'
+                checks.append(f'({row} := {innermost}.items[{index}]) is not None')
+                innermost = row
+        return ' and '.join(checks), innermost, index
+
+    def index_tuple(self, indices: tuple) -> str:
+        return ''.join(f'{self.reg(register)}, ' for register in indices)
+
+    def generate(self):
+        function = self.function
+        params = ', '.join(f'r{slot}' for slot in range(function.param_count))
+        self.line(0, f'def {self.names[function.name]}({params}):')
+        header = len(self.lines)
+        others = [f'r{slot}' for slot in range(function.param_count, len(function.local_names))]
+        if others:
+            self.line(1, f"{' = '.join(others)} = UNDEFINED")
+        temps = [f'r{register}' for register in range(function.temp_base, len(function.template))]
+        if temps:
+            self.line(1, f"{' = '.join(temps)} = None")
+
+        self.build_blocks()
+        self.number_blocks()
+        self.find_dominators()
+        self.emit_statements(self.do_tree(self.order[0]), None, [], 1)
+        if self.uses_goto:
+            self.pc = 0
+            self.lines.insert(header, '    _goto = None')
+            self.line_pcs.insert(header, (function, 0))
+
+
+def generate_source(functions: dict):
+    """The Python source of every function in `functions`, with the generated-code
+    global name of each function, the constants the source refers to and, for
+    each line, the function and register pc it was generated from."""
+    names = {name: f'f{index}' for index, name in enumerate(functions)}
+    constants = {}
+    lines = []
+    line_pcs = []
+    for function in functions.values():
+        FunctionGenerator(function, names, constants, lines, line_pcs).generate()
+    return '\n'.join(lines) + '\n', names, constants, line_pcs
+
+
+def runtime_namespace(vm, sleep) -> dict:
+    """The globals generated code run by `vm` runs with."""
+    output = vm.output
+    namespace = {
+        'vm': vm,
+        'UNDEFINED': UNDEFINED, 'ListValue': ListValue, 'display': display,
+        'copy_template': copy_template,
+        'add': add, 'sub': sub, 'mul': mul, 'div': div, 'mod': mod, 'negate': negate,
+        'load_subscript': load_subscript, 'store_subscript': store_subscript,
+        'append': append, 'logical_not': logical_not, 'condition_error': condition_error,
+        'undefined_variable': undefined_variable,
+        'write': output.write, 'sleep': sleep, 'clear_screen': output.clear_screen,
+    }
+    namespace.update({name: function for function, (_, name) in COMPARISON_SOURCE.items()})
+    return namespace
+
+
+class CompiledVM:
+    """Runs scripts as generated Python code. Same language, same output and error
+    messages as the stack VM in `vm.py`; no profiler and no memoization."""
+    def __init__(self, func_decls: dict, output: OutputWriter=None, workers=None):
+        self.func_decls = func_decls
+        self.functions = compile_functions(func_decls)
+        self.output = output if output is not None else OutputWriter()
+        self.workers = workers
+        self.call_trace_stack = []
+        self.source, self.names, constants, self.line_pcs = generate_source(self.functions)
+        self.namespace = runtime_namespace(self, self.sleep)
+        self.namespace.update(constants)
+        exec(compile(self.source, FILENAME, 'exec'), self.namespace)
+
+    def run(self):
+        # Script calls are Python calls here, so deep recursion needs a higher limit.
+        recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(recursion_limit, 1_000_000))
+        try:
+            if 'main' not in self.functions:
+                raise RuntimeError("undefined function.")
+            self.namespace[self.names['main']]()
+        except RuntimeError as e:
+            self.call_trace_stack = self.trace(e.__traceback__)
+            self.output.write(f"Runtime error:  {e}\n")
+            self.print_stack_trace()
+        finally:
+            sys.setrecursionlimit(recursion_limit)
+            self.output.flush()
+
+    def print_stack_trace(self):
+        self.output.write("Stack trace:\n")
+        for frame in self.call_trace_stack:
+            self.output.write(f"\t <{frame}>\n")
+
+    def sleep(self, amount):
+        self.output.flush()
+        if not is_number(amount):
+            raise RuntimeError(f"Sleep duration must by of type `number` not `{type_name(amount)}`.")
+        time.sleep(amount)
+
+    def trace(self, traceback) -> list:
+        """The call trace at a runtime error, read off the generated functions'
+        frames in `traceback`. Functions that made a tail call are left out, as the
+        stack VM reuses their frames."""
+        trace = []
+        while traceback is not None:
+            if traceback.tb_frame.f_code.co_filename == FILENAME:
+                function, pc = self.line_pcs[traceback.tb_lineno - 1]
+                ins = function.code[pc]
+                if ins[0] != RegOp.TAIL_CALL or ins[1] is function:
+                    trace.append(function.name)
+                    trace.extend(name for start, end, name in function.inlined if start <= pc < end)
+            traceback = traceback.tb_next
+        return trace
@@ -0,0 +1,348 @@
+from array import array
+from functools import reduce
+from itertools import repeat
+from instructions import OpCode
+from values import ListValue, TYPECODES, ARRAY_TYPES, display, type_name
+from vm import COMPARISONS, add, sub, mul, div, mod, as_float
+import operator
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Built-ins that work on a whole grid, a list of lists nested to any depth, in one
+# call. Each applies the VM's own operations cell by cell, so it gives the results
+# and the errors of the loop it replaces. When NumPy is installed, grids of only
+# ints or only floats go through NumPy instead wherever that gives the same
+# results: ints that could overflow 64 bits, divisions by zero and the like are
+# left to the cell by cell version.
+
+INT64_LIMIT = 1 << 63
+# Ints up to this size convert to floats exactly.
+FLOAT_EXACT_LIMIT = 1 << 53
+
+# Element-wise operations: the VM's function and the NumPy ufunc that computes the
+# same on int64 and float64 arrays.
+OPERATIONS = {
+    'add': (add, 'add'),
+    'sub': (sub, 'subtract'),
+    'mul': (mul, 'multiply'),
+    'div': (div, 'true_divide'),
+    'mod': (mod, 'remainder'),
+    'eq':  (operator.eq, 'equal'),
+    'lt':  (COMPARISONS[OpCode.LESS], 'less'),
+    'le':  (COMPARISONS[OpCode.LESS_EQUAL], 'less_equal'),
+    'gt':  (COMPARISONS[OpCode.GREATER], 'greater'),
+    'ge':  (COMPARISONS[OpCode.GREATER_EQUAL], 'greater_equal'),
+}
+
+def expect_grid(value) -> ListValue:
+    if not isinstance(value, ListValue):
+        raise RuntimeError(f"Expect a grid, not a value of type `{type_name(value)}`.")
+    return value
+
+def copied(value):
+    """`value` with every list in it copied."""
+    if not isinstance(value, ListValue):
+        return value
+    items = value.items
+    if type(items) is array:
+        return ListValue.wrap(items[:])
+    return ListValue.wrap([copied(item) for item in items])
+
+def filled(value, sizes: list) -> ListValue:
+    if len(sizes) > 1:
+        return ListValue([filled(value, sizes[1:]) for _ in range(sizes[0])])
+    if isinstance(value, ListValue):
+        return ListValue([copied(value) for _ in range(sizes[0])])
+    typecode = TYPECODES.get(type(value))
+    if typecode is not None:
+        try:
+            return ListValue.wrap(array(typecode, [value]) * sizes[0])
+        except OverflowError:
+            # An int too big for 64 bits.
+            pass
+    return ListValue([value] * sizes[0])
+
+def runs(grid: ListValue):
+    """The cells of `grid` that aren't lists, in order, as arrays and lists."""
+    items = grid.items
+    if type(items) is array:
+        yield items
+        return
+    run = []
+    for item in items:
+        if isinstance(item, ListValue):
+            if run:
+                yield run
+                run = []
+            yield from runs(item)
+        else:
+            run.append(item)
+    if run:
+        yield run
+
+def combine(function, a, b):
+    """Applies `function` to the matching cells of `a` and `b`, either of which can
+    be a single value used for every cell."""
+    if isinstance(a, ListValue):
+        if isinstance(b, ListValue):
+            if len(a) != len(b):
+                raise RuntimeError("Can't combine grids of different sizes.")
+            if type(a.items) is array and type(b.items) is array:
+                return ListValue(list(map(function, a.items, b.items)))
+            return ListValue([combine(function, x, y) for x, y in zip(a.items, b.items)])
+        if type(a.items) is array:
+            return ListValue(list(map(function, a.items, repeat(b))))
+        return ListValue([combine(function, x, b) for x in a.items])
+    if isinstance(b, ListValue):
+        if type(b.items) is array:
+            return ListValue(list(map(function, repeat(a), b.items)))
+        return ListValue([combine(function, a, y) for y in b.items])
+    return function(a, b)
+
+def combine_grids(operation: str, a, b):
+    function, ufunc = OPERATIONS[operation]
+    if numpy is not None and (isinstance(a, ListValue) or isinstance(b, ListValue)):
+        result = numpy_combine(operation, ufunc, a, b)
+        if result is not None:
+            return result
+    return combine(function, a, b)
+
+def holds_no_lists(value) -> bool:
+    return (not isinstance(value, ListValue) or type(value.items) is array
+            or ListValue not in set(map(type, value.items)))
+
+def select(condition, a, b):
+    if isinstance(condition, ListValue):
+        size = len(condition)
+        cells = zip(condition.items, matching_cells(a, size), matching_cells(b, size))
+        if (set(map(type, condition.items)) <= {bool} and type(condition.items) is not array
+                and holds_no_lists(a) and holds_no_lists(b)):
+            # A row of conditions choosing between cells that need no copying.
+            return ListValue([x if c else y for c, x, y in cells])
+        return ListValue([select(c, x, y) for c, x, y in cells])
+    if type(condition) is not bool:
+        raise RuntimeError(f"Condition can't be of type `{type_name(condition)}`.")
+    return copied(a if condition else b)
+
+def matching_cells(value, size: int):
+    if not isinstance(value, ListValue):
+        return repeat(value, size)
+    if len(value) != size:
+        raise RuntimeError("Can't combine grids of different sizes.")
+    return value.items
+
+def grid_rows(grid) -> list:
+    """The rows of the 2-D grid `grid`."""
+    rows = list(expect_grid(grid).items)
+    if not all(isinstance(row, ListValue) for row in rows):
+        raise RuntimeError("Expect a grid whose cells are all in rows.")
+    if any(len(row) != len(rows[0]) for row in rows):
+        raise RuntimeError("Expect a grid whose rows all have the same length.")
+    return rows
+
+def count_neighbors(rows: list, value) -> ListValue:
+    hits = [[cell == value for cell in row.items] for row in rows]
+    border = [False] * (len(rows[0]) + 2)
+    padded = [border, *([False, *row, False] for row in hits), border]
+    counts = []
+    for above, here, below in zip(padded, padded[1:], padded[2:]):
+        # Each cell's column of three, then three columns side by side, less the cell.
+        columns = [x + y + z for x, y, z in zip(above, here, below)]
+        counts.append(ListValue([left + middle + right - cell for left, middle, right, cell in
+                                 zip(columns, columns[1:], columns[2:], here[1:])]))
+    return ListValue(counts)
+
+def magnitude(value) -> int:
+    """The largest absolute value among ints in an array or a single int."""
+    if type(value) is int:
+        return abs(value)
+    return max(int(value.max()), -int(value.min()))
+
+def numeric_grid(grid: ListValue):
+    """`grid` as a NumPy array if it is a rectangular grid of only ints or only
+    floats, with no empty lists in it, else None."""
+    shape = []
+    level = [grid]
+    while True:
+        size = len(level[0])
+        if size == 0 or any(len(value) != size for value in level):
+            return None
+        shape.append(size)
+        if type(level[0].items) is array:
+            break
+        level = [item for value in level for item in value.items]
+        if not all(type(item) is ListValue for item in level):
+            return None
+    typecode = level[0].items.typecode
+    cells = array(typecode)
+    for value in level:
+        if type(value.items) is not array or value.items.typecode != typecode:
+            return None
+        cells.extend(value.items)
+    return numpy.frombuffer(cells, DTYPES[typecode]).reshape(shape)
+
+def numeric_operand(value):
+    """`value` as a NumPy array or a number, and the type of the numbers in it, if
+    it holds only ints or only floats NumPy can hold; else (None, None)."""
+    if isinstance(value, ListValue):
+        cells = numeric_grid(value)
+        if cells is None:
+            return None, None
+        return cells, int if cells.dtype == numpy.int64 else float
+    if type(value) is int and -INT64_LIMIT <= value < INT64_LIMIT or type(value) is float:
+        return value, type(value)
+    return None, None
+
+def numpy_combine(operation: str, ufunc: str, a, b):
+    """The result of `combine` computed by NumPy, or None if NumPy can't give the
+    same result."""
+    x, kind = numeric_operand(a)
+    y, other_kind = numeric_operand(b)
+    if kind is None or kind is not other_kind:
+        return None
+    if type(x) is numpy.ndarray and type(y) is numpy.ndarray and x.shape != y.shape:
+        return None
+    if kind is int:
+        bound_x, bound_y = magnitude(x), magnitude(y)
+        if operation in ('add', 'sub') and bound_x + bound_y >= INT64_LIMIT:
+            return None
+        if operation == 'mul' and bound_x * bound_y >= INT64_LIMIT:
+            return None
+        if operation == 'div' and max(bound_x, bound_y) > FLOAT_EXACT_LIMIT:
+            return None
+    elif operation == 'mod':
+        # Python's float modulo has corner cases of its own.
+        return None
+    if operation in ('div', 'mod') and numpy.any(numpy.asarray(y) == 0):
+        return None
+    # Floats overflow to inf quietly, as they do in Python.
+    with numpy.errstate(all='ignore'):
+        return grid_of(getattr(numpy, ufunc)(x, y))
+
+def grid_of(values) -> ListValue:
+    """The grid holding a NumPy array of int64s, float64s or bools."""
+    width = values.shape[-1]
+    if values.dtype == numpy.bool_:
+        rows = [ListValue.wrap(row) for row in values.reshape(-1, width).tolist()]
+    else:
+        typecode = 'q' if values.dtype == numpy.int64 else 'd'
+        rows = [ListValue.wrap(array(typecode, row.tobytes())) for row in values.reshape(-1, width)]
+    for size in reversed(values.shape[:-1]):
+        rows = [ListValue.wrap(rows[start:start + size]) for start in range(0, len(rows), size)]
+    return rows[0]
+
+def numpy_neighbors(grid: ListValue, rows: list, value) -> ListValue:
+    hits = None
+    if type(value) in (int, float):
+        cells = numeric_grid(grid)
+        if cells is not None and cells.ndim == 2 and cells.dtype == DTYPES[TYPECODES[type(value)]]:
+            hits = cells == value
+    if hits is None:
+        cells = numpy.empty((len(rows), len(rows[0])), dtype=object)
+        for index, row in enumerate(rows):
+            cells[index] = row.as_list()
+        # Compares each cell with Python's `==`, as the language does.
+        hits = numpy.equal(cells, numpy.array(value, dtype=object), dtype=object).astype(bool)
+    height, width = hits.shape
+    padded = numpy.zeros((height + 2, width + 2), numpy.int64)
+    padded[1:-1, 1:-1] = hits
+    return grid_of(padded[:-2, :-2] + padded[:-2, 1:-1] + padded[:-2, 2:] +
+                   padded[1:-1, :-2] + padded[1:-1, 2:] +
+                   padded[2:, :-2] + padded[2:, 1:-1] + padded[2:, 2:])
+
+def sum_run(run, total):
+    if type(run) is not array:
+        return reduce(add, run, total)
+    if run.typecode == 'd' or type(total) is not int:
+        if type(total) is int and run:
+            # What adding the first float would turn it into, without overflowing.
+            total = as_float(total)
+        # One addition at a time, in order, like a loop would.
+        return reduce(operator.add, run, total)
+    if numpy is not None and run:
+        values = numpy.frombuffer(run, numpy.int64)
+        if magnitude(values) * len(run) < INT64_LIMIT:
+            return total + int(values.sum())
+    return sum(run, total)
+
+def count_run(run, value) -> int:
+    if (numpy is not None and type(run) is array and run and type(value) is ARRAY_TYPES[run.typecode]
+            and (type(value) is float or -INT64_LIMIT <= value < INT64_LIMIT)):
+        return int(numpy.count_nonzero(numpy.frombuffer(run, DTYPES[run.typecode]) == value))
+    return run.count(value)
+
+if numpy is not None:
+    DTYPES = {'q': numpy.int64, 'd': numpy.float64}
+
+
+def grid(vm, args: list):
+    """`grid(value, sizes...)`: a new grid of the given sizes, every cell holding
+    `value` (or a copy of it, for lists)."""
+    value, sizes = args[0], args[1:]
+    for size in sizes:
+        if not (type(size) is int or type(size) is float and size.is_integer()) or size < 0:
+            raise RuntimeError(f"Can't make a grid of size `{display(size)}`.")
+    return filled(value, [int(size) for size in sizes])
+
+def grid_copy(vm, args: list):
+    return copied(expect_grid(args[0]))
+
+def grid_sum(vm, args: list):
+    total = 0
+    for run in runs(expect_grid(args[0])):
+        total = sum_run(run, total)
+    return total
+
+def grid_count(vm, args: list):
+    """`grid_count(grid, value)`: how many cells are equal to `value`."""
+    grid, value = args
+    return sum(count_run(run, value) for run in runs(expect_grid(grid)))
+
+def grid_add(vm, args: list):
+    return combine_grids('add', *args)
+
+def grid_sub(vm, args: list):
+    return combine_grids('sub', *args)
+
+def grid_mul(vm, args: list):
+    return combine_grids('mul', *args)
+
+def grid_div(vm, args: list):
+    return combine_grids('div', *args)
+
+def grid_mod(vm, args: list):
+    return combine_grids('mod', *args)
+
+def grid_eq(vm, args: list):
+    return combine_grids('eq', *args)
+
+def grid_lt(vm, args: list):
+    return combine_grids('lt', *args)
+
+def grid_le(vm, args: list):
+    return combine_grids('le', *args)
+
+def grid_gt(vm, args: list):
+    return combine_grids('gt', *args)
+
+def grid_ge(vm, args: list):
+    return combine_grids('ge', *args)
+
+def grid_select(vm, args: list):
+    """`grid_select(condition, a, b)`: the cells of `a` where `condition` is true and
+    those of `b` where it is false."""
+    return select(*args)
+
+def neighbors(vm, args: list):
+    """`neighbors(grid, value)`: for each cell of a 2-D grid, how many of the eight
+    cells around it are equal to `value`."""
+    grid, value = args
+    rows = grid_rows(grid)
+    if not rows or not len(rows[0]):
+        return copied(grid)
+    if numpy is not None:
+        return numpy_neighbors(grid, rows, value)
+    return count_neighbors(rows, value)
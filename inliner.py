@@ -0,0 +1,96 @@
+from instructions import OpCode, Instruction, SLOT_OPERANDS, decode, encode
+
+CALLS = {OpCode.CALL, OpCode.TAIL_CALL}
+
+def inlinable(func_decl, limit: int):
+    """Leaf functions of at most `limit` instructions whose locals are all parameters.
+    Other locals would keep their values between inlined calls instead of starting
+    out undefined."""
+    if func_decl.name == 'main' or len(func_decl.local_names) != len(func_decl.params):
+        return False
+    instructions = decode(func_decl.code_segment)
+    if len(instructions) > limit:
+        return False
+    return not any(instruction.op in CALLS for instruction in instructions)
+
+
+class _Inliner:
+    def __init__(self, caller, candidates: set):
+        self.caller = caller
+        self.candidates = candidates
+        # First local slot of each callee's copy of its locals. Calls to the same
+        # callee share the slots, since a leaf function never re-enters itself.
+        self.slot_bases = {}
+        # [first, last, name] for each inlined body, first and last being Instructions.
+        self.ranges = []
+
+    def slot_base(self, callee):
+        if callee.name not in self.slot_bases:
+            self.slot_bases[callee.name] = len(self.caller.local_names)
+            self.caller.local_names.extend(callee.local_names)
+        return self.slot_bases[callee.name]
+
+    def expand(self, call: Instruction, end: Instruction):
+        """Returns the instructions replacing `call`: stores of the arguments into
+        the callee's slots, then its body with RET jumping to `end`. A tail call
+        keeps the RETs, the caller returns right after it anyway."""
+        callee, arg_count = call.operands
+        base = self.slot_base(callee)
+        stores = [Instruction(OpCode.STORE_LOCAL, [base + slot]) for slot in reversed(range(arg_count))]
+
+        body = decode(callee.code_segment)
+        for instruction in body:
+            for index in SLOT_OPERANDS.get(instruction.op, ()):
+                instruction.operands[index] += base
+        if call.op == OpCode.CALL:
+            for instruction in body:
+                if instruction.op == OpCode.RET:
+                    instruction.op, instruction.operands, instruction.target = OpCode.JUMP, [0], end
+            # The last RET falls through to `end`, unless something jumps to it.
+            last = body[-1]
+            if last.op == OpCode.JUMP and last.target is end and \
+                    not any(instruction.target is last for instruction in body):
+                body.pop()
+        return stores + body
+
+    def inline(self):
+        instructions = decode(self.caller.code_segment)
+        output = []
+        # Jumps to an inlined call go to the first instruction that replaced it.
+        replaced = {}
+        for index, instruction in enumerate(instructions):
+            if instruction.op in CALLS and instruction.operands[0].name in self.candidates:
+                end = instructions[index + 1] if index + 1 < len(instructions) else None
+                expansion = self.expand(instruction, end)
+                replaced[id(instruction)] = expansion[0]
+                self.ranges.append([expansion[0], expansion[-1], instruction.operands[0].name])
+                output.extend(expansion)
+            else:
+                output.append(instruction)
+        if not replaced:
+            return
+        for instruction in output:
+            if instruction.target is not None:
+                instruction.target = replaced.get(id(instruction.target), instruction.target)
+
+        self.caller.code_segment = encode(output)
+        positions = {}
+        ip = 0
+        for instruction in output:
+            positions[id(instruction)] = ip
+            ip += instruction.size()
+        for first, last, name in self.ranges:
+            self.caller.inlined.append((positions[id(first)], positions[id(last)] + last.size(), name))
+
+
+def inline(function_declarations: dict, limit: int):
+    """Copies calls to small leaf functions into their callers. Runs on linked,
+    optimized code; stack traces still show the inlined functions by name."""
+    candidates = {name for name, func_decl in function_declarations.items()
+                  if inlinable(func_decl, limit)}
+    if not candidates:
+        return function_declarations
+    for func_decl in function_declarations.values():
+        if func_decl.name not in candidates:
+            _Inliner(func_decl, candidates).inline()
+    return function_declarations
@@ -1,6 +1,8 @@
-from enum import Enum, auto
+from enum import IntEnum, auto
 
-class OpCode(Enum):
+# Opcodes are dense small integers starting at 1 so the VM can dispatch
+# by indexing straight into a handler table.
+class OpCode(IntEnum):
     ADD           = auto()
     SUB           = auto()
     MUL           = auto()
@@ -18,18 +20,176 @@ class OpCode(Enum):
     GREATER_EQUAL = auto()
     LESS          = auto()
     LESS_EQUAL    = auto()
-    IDENTIFIER    = auto()
     JUMP_FALSE    = auto()
     JUMP          = auto()
     LOOP          = auto()
     PRINT         = auto()
     PRINTLN       = auto()
-    ASSIGNMENT    = auto()
     LIST          = auto()
-    SUBSCRIPT     = auto()
-    RESOLVE       = auto()
     RET           = auto()
     CALL          = auto()
     SLEEP         = auto()
     APPEND        = auto()
-    CLRSCRN       = auto()
\ No newline at end of file
+    CLRSCRN       = auto()
+    LOAD_LOCAL    = auto()
+    STORE_LOCAL   = auto()
+    LOAD_SUBSCRIPT  = auto()
+    STORE_SUBSCRIPT = auto()
+    JUMP_TRUE     = auto()
+    LIST_CONST    = auto()
+    POP           = auto()
+    # Only produced by the linker, for calls to the functions in `natives.py`.
+    CALL_NATIVE   = auto()
+
+    # Superinstructions, only produced by the optimizer.
+    INC_LOCAL                = auto()
+    DEC_LOCAL                = auto()
+    COMPARE_LOCAL_CONST_JUMP = auto()
+    COMPARE_LOCALS_JUMP      = auto()
+    TAIL_CALL                = auto()
+
+    # Type-specialized versions of generic instructions. The VM rewrites a generic
+    # instruction into one of these once it has seen its operand types.
+    ADD_INT             = auto()
+    SUB_INT             = auto()
+    MUL_INT             = auto()
+    DIV_INT             = auto()
+    MODULO_INT          = auto()
+    GREATER_INT         = auto()
+    GREATER_EQUAL_INT   = auto()
+    LESS_INT            = auto()
+    LESS_EQUAL_INT      = auto()
+    ADD_FLOAT           = auto()
+    ADD_STR             = auto()
+    SUB_FLOAT           = auto()
+    MUL_FLOAT           = auto()
+    DIV_FLOAT           = auto()
+    MODULO_FLOAT        = auto()
+    GREATER_FLOAT       = auto()
+    GREATER_EQUAL_FLOAT = auto()
+    LESS_FLOAT          = auto()
+    LESS_EQUAL_FLOAT    = auto()
+
+
+# Number of operands stored inline after each opcode in a code segment.
+OPERAND_COUNT = {
+    OpCode.NUMBER:      1,
+    OpCode.STRING:      1,
+    OpCode.JUMP_FALSE:  1,
+    OpCode.JUMP_TRUE:   1,
+    OpCode.JUMP:        1,
+    OpCode.LOOP:        1,
+    OpCode.LIST:        1,
+    OpCode.LIST_CONST:  1,
+    OpCode.CALL:        2,                  # function, argument count
+    OpCode.CALL_NATIVE: 2,                  # Native, argument count
+    OpCode.LOAD_LOCAL:  1,
+    OpCode.STORE_LOCAL: 1,
+    OpCode.LOAD_SUBSCRIPT:  2,              # slot, dimensions
+    OpCode.STORE_SUBSCRIPT: 2,              # slot, dimensions
+
+    OpCode.INC_LOCAL:                2,     # slot, amount
+    OpCode.DEC_LOCAL:                2,     # slot, amount
+    OpCode.COMPARE_LOCAL_CONST_JUMP: 4,     # slot, constant, comparison opcode, offset
+    OpCode.COMPARE_LOCALS_JUMP:      4,     # slot, slot, comparison opcode, offset
+    OpCode.TAIL_CALL:                2,     # function, argument count
+}
+
+# The generic instruction each type-specialized one was rewritten from.
+GENERIC_OPS = {
+    OpCode.ADD_INT: OpCode.ADD, OpCode.ADD_FLOAT: OpCode.ADD, OpCode.ADD_STR: OpCode.ADD,
+    OpCode.SUB_INT: OpCode.SUB, OpCode.SUB_FLOAT: OpCode.SUB,
+    OpCode.MUL_INT: OpCode.MUL, OpCode.MUL_FLOAT: OpCode.MUL,
+    OpCode.DIV_INT: OpCode.DIV, OpCode.DIV_FLOAT: OpCode.DIV,
+    OpCode.MODULO_INT: OpCode.MODULO, OpCode.MODULO_FLOAT: OpCode.MODULO,
+    OpCode.GREATER_INT: OpCode.GREATER, OpCode.GREATER_FLOAT: OpCode.GREATER,
+    OpCode.GREATER_EQUAL_INT: OpCode.GREATER_EQUAL, OpCode.GREATER_EQUAL_FLOAT: OpCode.GREATER_EQUAL,
+    OpCode.LESS_INT: OpCode.LESS, OpCode.LESS_FLOAT: OpCode.LESS,
+    OpCode.LESS_EQUAL_INT: OpCode.LESS_EQUAL, OpCode.LESS_EQUAL_FLOAT: OpCode.LESS_EQUAL,
+}
+
+# Index of the jump offset among each jump's operands. Forward jump offsets are
+# relative to the end of the instruction, LOOP offsets count back from its operand.
+JUMP_OPERAND = {
+    OpCode.JUMP_FALSE: 0,
+    OpCode.JUMP_TRUE:  0,
+    OpCode.JUMP:       0,
+    OpCode.LOOP:       0,
+
+    OpCode.COMPARE_LOCAL_CONST_JUMP: 3,
+    OpCode.COMPARE_LOCALS_JUMP:      3,
+}
+
+# Indices of the operands that are local slots.
+SLOT_OPERANDS = {
+    OpCode.LOAD_LOCAL:      (0,),
+    OpCode.STORE_LOCAL:     (0,),
+    OpCode.LOAD_SUBSCRIPT:  (0,),
+    OpCode.STORE_SUBSCRIPT: (0,),
+
+    OpCode.INC_LOCAL:                (0,),
+    OpCode.DEC_LOCAL:                (0,),
+    OpCode.COMPARE_LOCAL_CONST_JUMP: (0,),
+    OpCode.COMPARE_LOCALS_JUMP:      (0, 1),
+}
+
+
+class Instruction:
+    """A decoded instruction. For jumps, `target` is the Instruction jumped to and the
+    offset operand is recomputed by `encode`."""
+    def __init__(self, op: OpCode, operands: list, target=None):
+        self.op = op
+        self.operands = operands
+        self.target = target
+
+    def size(self):
+        return 1 + len(self.operands)
+
+    def __repr__(self) -> str:
+        return f'{self.op.name} {self.operands}'
+
+
+def decode(code_segment: list) -> list[Instruction]:
+    instructions = []
+    by_position = {}
+    ip = 0
+    while ip < len(code_segment):
+        op = OpCode(code_segment[ip])
+        count = OPERAND_COUNT.get(op, 0)
+        instruction = Instruction(op, code_segment[ip + 1:ip + 1 + count])
+        by_position[ip] = instruction
+        instructions.append(instruction)
+        ip += 1 + count
+
+    ip = 0
+    for instruction in instructions:
+        if instruction.op in JUMP_OPERAND:
+            offset = instruction.operands[JUMP_OPERAND[instruction.op]]
+            if instruction.op == OpCode.LOOP:
+                target = ip + 1 - offset
+            else:
+                target = ip + instruction.size() + offset
+            instruction.target = by_position[target]
+        ip += instruction.size()
+    return instructions
+
+def encode(instructions: list[Instruction]) -> list:
+    positions = {}
+    ip = 0
+    for instruction in instructions:
+        positions[id(instruction)] = ip
+        ip += instruction.size()
+
+    code_segment = []
+    for instruction in instructions:
+        if instruction.op in JUMP_OPERAND:
+            ip = positions[id(instruction)]
+            target = positions[id(instruction.target)]
+            if instruction.op == OpCode.LOOP:
+                offset = ip + 1 - target
+            else:
+                offset = target - (ip + instruction.size())
+            instruction.operands[JUMP_OPERAND[instruction.op]] = offset
+        code_segment.append(instruction.op)
+        code_segment.extend(instruction.operands)
+    return code_segment
@@ -1,22 +1,108 @@
 from vm import VM
-from parsing import parse
-from tokenization import tokenize
-import sys
+from register_vm import RegisterVM
+from compiled_vm import CompiledVM
+from output import OutputWriter
+from profiler import Profiler
+from memo import Memoizer
+from loop_compiler import LoopCompiler
+from parallel import Workers
+from linker import link
+import bytecode_cache
+import optimizer
+import inliner
+import argparse
 
-def run_file(filePath):
+def run_file(filePath, use_cache=True, rebuild_cache=False, optimize_level=2, 
+             profile=False, profile_json=None, output_path=None,
+             memoize=True, memo_size=1024, memo_stats=False, inline=False, inline_limit=16,
+             backend='stack', tiering=True, tier_threshold=1000, tier_stats=False, workers=None):
     try:
         with open(filePath) as file:
-            VM(parse(tokenize(file.read()))).run()
+            source = file.read()
     except FileNotFoundError:
         print(f"Could not open file `{filePath}`.")
+        return
+    func_decls = link(bytecode_cache.compile_source(filePath, source, use_cache, rebuild_cache))
+    optimizer.optimize(func_decls, optimize_level)
+    if inline:
+        inliner.inline(func_decls, inline_limit)
+    profiler = Profiler() if profile or profile_json else None
+    # Only the stack backend has a profiler and memoization.
+    memoizer = Memoizer(func_decls, memo_size) if memoize and backend == 'stack' else None
+    # Tiering counts loop iterations in the stack VM, which the profiler counts too.
+    loop_compiler = (LoopCompiler(func_decls, tier_threshold)
+                     if tiering and backend == 'stack' and profiler is None else None)
+    # Workers run calls on the stack VM whatever the backend.
+    worker_pool = Workers(func_decls, workers, memoize, tier_threshold if tiering else None)
+    sink = open(output_path, 'w') if output_path is not None else None
+    try:
+        if backend == 'register':
+            RegisterVM(func_decls, OutputWriter(sink), worker_pool).run()
+        elif backend == 'compiled':
+            CompiledVM(func_decls, OutputWriter(sink), worker_pool).run()
+        else:
+            VM(func_decls, profiler, OutputWriter(sink), memoizer, loop_compiler, worker_pool).run()
+    finally:
+        worker_pool.shutdown()
+        if sink is not None:
+            sink.close()
+    if memoizer is not None and memo_stats:
+        memoizer.report()
+    if loop_compiler is not None and tier_stats:
+        loop_compiler.report()
+    if profiler is not None:
+        profiler.report()
+        if profile_json:
+            profiler.write_json(profile_json)
 
-def usage():
-    print('Usage: interpreter.py <filename>')
+def arg_parser():
+    parser = argparse.ArgumentParser(prog='interpreter.py')
+    parser.add_argument('filename')
+    parser.add_argument('--no-cache', action='store_true',
+                        help="don't read or write the bytecode cache file; use it when others can " +
+                             "write to the script's directory, as the cache is trusted")
+    parser.add_argument('--rebuild-cache', action='store_true',
+                        help='recompile the script and overwrite its bytecode cache file')
+    parser.add_argument('-O', type=int, default=2, choices=[0, 1, 2], dest='optimize_level',
+                        help='bytecode optimization level (default: 2, 0 disables the optimizer)')
+    parser.add_argument('--backend', choices=['stack', 'register', 'compiled'], default='stack',
+                        help='run the stack bytecode directly (default), compile it to register code, ' +
+                             'or compile that to Python functions')
+    parser.add_argument('--inline', action='store_true',
+                        help='copy small leaf functions into their callers')
+    parser.add_argument('--inline-limit', type=int, default=16, metavar='N',
+                        help='largest function, in instructions, that --inline copies (default: 16)')
+    parser.add_argument('--no-tiering', action='store_true',
+                        help="don't compile hot loops of the stack backend to Python functions")
+    parser.add_argument('--tier-threshold', type=int, default=1000, metavar='N',
+                        help='iterations after which a loop is compiled (default: 1000)')
+    parser.add_argument('--tier-stats', action='store_true',
+                        help='report the compiled loops to stderr at exit')
+    parser.add_argument('--workers', type=int, metavar='N',
+                        help='most worker processes for `spawn` and `pmap` (default: one per CPU)')
+    parser.add_argument('--output', metavar='PATH', dest='output_path',
+                        help="write the script's output to PATH instead of stdout")
+    parser.add_argument('--no-memo', action='store_true',
+                        help="don't cache the return values of pure functions")
+    parser.add_argument('--memo-size', type=int, default=1024, metavar='N',
+                        help='cached return values kept per function (default: 1024)')
+    parser.add_argument('--memo-stats', action='store_true',
+                        help='report cache hits and misses per memoized function to stderr at exit')
+    parser.add_argument('--profile', action='store_true',
+                        help='count opcodes, time functions and count call sites; report to stderr at exit')
+    parser.add_argument('--profile-json', metavar='PATH',
+                        help='also write the profile as JSON to PATH (implies --profile)')
+    return parser
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        usage()
-        sys.exit(0)
-    filePath = sys.argv[1]
-    if filePath != None:
-        run_file(filePath)
+    parser = arg_parser()
+    args = parser.parse_args()
+    if args.backend != 'stack' and (args.profile or args.profile_json):
+        parser.error('--profile needs the stack backend')
+    if args.workers is not None and args.workers < 1:
+        parser.error('--workers must be at least 1')
+    run_file(args.filename, not args.no_cache, args.rebuild_cache, args.optimize_level,
+             args.profile, args.profile_json, args.output_path,
+             not args.no_memo, args.memo_size, args.memo_stats, args.inline, args.inline_limit,
+             args.backend, not args.no_tiering, args.tier_threshold, args.tier_stats,
+             args.workers)
@@ -0,0 +1,50 @@
+from instructions import OpCode, OPERAND_COUNT
+from natives import NATIVES
+import sys
+
+CALLS = {OpCode.CALL, OpCode.TAIL_CALL}
+
+def link(function_declarations: dict):
+    """Replaces the function name in every call with the called FunctionDeclaration,
+    so the VM doesn't look names up at runtime. Calls to undefined functions and
+    calls with the wrong number of arguments are reported here, before the program
+    runs, and stop the interpreter the way parse errors do. Calls to names that
+    aren't defined in the script but are in `NATIVES` become CALL_NATIVEs."""
+    errors = []
+    main = function_declarations.get('main')
+    if main is None:
+        errors.append("Expect a `main` function.")
+    elif main.params:
+        errors.append(f"Function `main` expects `{len(main.params)}` # of params but got `0`.")
+
+    for func_decl in function_declarations.values():
+        code_segment = func_decl.code_segment
+        ip = 0
+        while ip < len(code_segment):
+            op = code_segment[ip]
+            if op in CALLS:
+                name = code_segment[ip + 1]
+                arg_count = code_segment[ip + 2]
+                callee = function_declarations.get(name)
+                native = NATIVES.get(name)
+                if callee is None and native is not None:
+                    if not native.accepts(arg_count):
+                        errors.append(f"Function `{name}` expects {native.expected_args()} # of params " +
+                                      f"but got `{arg_count}` in `{func_decl.name}`.")
+                    else:
+                        code_segment[ip] = OpCode.CALL_NATIVE
+                        code_segment[ip + 1] = native
+                elif callee is None:
+                    errors.append(f"Undefined function `{name}` called in `{func_decl.name}`.")
+                elif len(callee.params) != arg_count:
+                    errors.append(f"Function `{name}` expects `{len(callee.params)}` # of params " +
+                                  f"but got `{arg_count}` in `{func_decl.name}`.")
+                else:
+                    code_segment[ip + 1] = callee
+            ip += 1 + OPERAND_COUNT.get(op, 0)
+
+    for error in errors:
+        print(error)
+    if errors:
+        sys.exit(0)
+    return function_declarations
@@ -0,0 +1,338 @@
+from compiled_vm import FunctionGenerator, NUMBER_TYPES, runtime_namespace
+from register_vm import RegOp, RegisterFunction, compile_function
+from values import ListValue, is_number, type_name
+from vm import UNDEFINED
+import copy
+import sys
+import time
+
+# A loop's back edge, the LOOP instruction at the end of its body, counts how
+# often it is taken. Once that passes the threshold the loop, from its header to
+# the LOOP, is compiled to a Python function through the same register code and
+# code generator as `--backend compiled`. From then on the back edge calls that
+# function, which runs the loop to its end and tells the VM where to go on.
+
+# Register instructions whose first operand is the register they write.
+WRITES = {RegOp.MOVE, RegOp.ADD, RegOp.SUB, RegOp.MUL, RegOp.DIV, RegOp.MODULO,
+          RegOp.COMPARE, RegOp.NEGATE, RegOp.NOT, RegOp.LIST, RegOp.LIST_CONST,
+          RegOp.LOAD_SUBSCRIPT, RegOp.CALL, RegOp.CALL_NATIVE}
+BRANCHES = {RegOp.JUMP, RegOp.JUMP_FALSE, RegOp.JUMP_TRUE, RegOp.COMPARE_JUMP}
+ARITHMETIC = {RegOp.ADD, RegOp.SUB, RegOp.MUL, RegOp.MODULO}
+
+# Type of a register that is never written in the loop.
+UNWRITTEN = object()
+
+def registers_of(ins: tuple) -> list:
+    """The registers an instruction reads or writes."""
+    op = ins[0]
+    if op in (RegOp.MOVE, RegOp.NEGATE, RegOp.NOT, RegOp.APPEND):
+        return [ins[1], ins[2]]
+    if op in (RegOp.ADD, RegOp.SUB, RegOp.MUL, RegOp.DIV, RegOp.MODULO, RegOp.COMPARE):
+        return [ins[1], ins[2], ins[3]]
+    if op in (RegOp.PRINT, RegOp.PRINTLN, RegOp.SLEEP, RegOp.CHECK_DEFINED,
+              RegOp.JUMP_FALSE, RegOp.JUMP_TRUE, RegOp.RET, RegOp.LIST_CONST):
+        return [ins[1]]
+    if op == RegOp.LIST:
+        return [ins[1], *ins[2]]
+    if op == RegOp.LOAD_SUBSCRIPT:
+        return [ins[1], ins[2], *ins[3]]
+    if op == RegOp.STORE_SUBSCRIPT:
+        return [ins[1], *ins[2], ins[3]]
+    if op == RegOp.COMPARE_JUMP:
+        return [ins[2], ins[3]]
+    if op in (RegOp.CALL, RegOp.CALL_NATIVE):
+        return [ins[1], *ins[3]]
+    if op in (RegOp.TAIL_CALL, RegOp.EXIT):
+        return list(ins[2])
+    return []
+
+def result_type(ins: tuple, type_of):
+    """The type of the value `ins` writes, given the types of its operands, or None
+    if it can't be told."""
+    op = ins[0]
+    if op == RegOp.MOVE:
+        return type_of(ins[2])
+    if op in ARITHMETIC or op == RegOp.DIV:
+        a, b = type_of(ins[2]), type_of(ins[3])
+        if op == RegOp.ADD and a is str and b is str:
+            return str
+        if a not in NUMBER_TYPES or b not in NUMBER_TYPES:
+            return None
+        return int if a is int and b is int and op != RegOp.DIV else float
+    if op == RegOp.NEGATE:
+        kind = type_of(ins[2])
+        return kind if kind in NUMBER_TYPES else None
+    if op in (RegOp.COMPARE, RegOp.NOT):
+        return bool
+    if op in (RegOp.LIST, RegOp.LIST_CONST):
+        return ListValue
+    return None
+
+
+class _Loop:
+    """A compiled loop. `function` takes the running Func_obj and returns the code
+    segment position to continue at, or None if a type guard failed."""
+    def __init__(self, name: str, header_ip: int):
+        self.name = name
+        self.header_ip = header_ip
+        self.function = None
+        # The types the loop was specialized for, by local name.
+        self.types = {}
+        self.runs = 0
+        self.guard_failures = 0
+        self.ips = []
+        self.line_pcs = []
+        self.filename = None
+
+    def error_ip(self, traceback) -> int:
+        """The code segment position of the instruction that raised, from the
+        innermost frame of the compiled loop in `traceback`."""
+        ip = None
+        while traceback is not None:
+            if traceback.tb_frame.f_code.co_filename == self.filename:
+                _, pc = self.line_pcs[traceback.tb_lineno - 1]
+                ip = self.ips[pc]
+            traceback = traceback.tb_next
+        return ip
+
+
+class _LoopGenerator(FunctionGenerator):
+    """Writes the Python source of a loop. Locals whose type is the same whenever
+    they are written in the loop, and was that type on entry, are specialized on:
+    the function checks their types once on entry and their arithmetic and
+    comparisons then run without checks."""
+    def __init__(self, loop_code: RegisterFunction, func_decls: dict, types: dict,
+                 constants: dict, lines: list, line_pcs: list):
+        super().__init__(loop_code, {}, constants, lines, line_pcs)
+        self.func_decls = func_decls
+        self.types = types
+
+    def value_type(self, register: int):
+        if self.is_constant(register):
+            return type(self.function.template[register])
+        return self.types.get(register)
+
+    def type_source(self, kind: type) -> str:
+        if kind in (int, float, str, bool, ListValue):
+            return kind.__name__
+        return self.constant(kind)
+
+    def emit_instruction(self, ins: tuple, indent: int):
+        op = ins[0]
+        if op == RegOp.CALL:
+            args = ', '.join(map(self.reg, ins[3]))
+            callee = self.constant(self.func_decls[ins[2].name])
+            self.line(indent, f'{self.reg(ins[1])} = call({callee}, [{args}])')
+        elif op == RegOp.EXIT:
+            if self.written:
+                self.line(indent, f"{', '.join(f'l[{slot}]' for slot in self.written)}, = " +
+                          f"{', '.join(f'r{slot}' for slot in self.written)},")
+            if ins[2]:
+                self.line(indent, f"frame.operand_stack.extend(({', '.join(map(self.reg, ins[2]))},))")
+            self.line(indent, f'return {ins[1]}')
+        else:
+            super().emit_instruction(ins, indent)
+
+    def generate(self, name: str, used: list, written: list):
+        self.written = written
+        self.line(0, f'def {name}(frame):')
+        self.line(1, 'l = frame.locals')
+        if used:
+            self.line(1, f"{', '.join(f'r{slot}' for slot in used)}, = " +
+                      f"{', '.join(f'l[{slot}]' for slot in used)},")
+        guards = [f'type(r{slot}) is not {self.type_source(self.types[slot])}'
+                  for slot in used if self.types.get(slot) is not None]
+        if guards:
+            self.line(1, f"if {' or '.join(guards)}: return None")
+        function = self.function
+        temps = [f'r{register}' for register in range(function.temp_base, len(function.template))]
+        if temps:
+            self.line(1, f"{' = '.join(temps)} = None")
+
+        self.build_blocks()
+        self.number_blocks()
+        self.find_dominators()
+        header = len(self.lines)
+        self.emit_statements(self.do_tree(self.order[0]), None, [], 1)
+        if self.uses_goto:
+            self.lines.insert(header, '    _goto = None')
+            self.line_pcs.insert(header, (function, 0))
+
+
+class LoopCompiler:
+    """Counts the back edges of the loops in `func_decls` and compiles the loops
+    taken more than `threshold` times. Must be made before the VM runs, which
+    rewrites instructions in place as it quickens them."""
+    def __init__(self, func_decls: dict, threshold: int=1000):
+        self.threshold = threshold
+        self.func_decls = func_decls
+        # The code segments as they were before the VM ran, by the identity of the
+        # code segment the VM runs.
+        self.originals = {id(func_decl.code_segment): (func_decl, list(func_decl.code_segment))
+                          for func_decl in func_decls.values()}
+        self.register_code = {}
+        self.counts = {}
+        # Compiled loops by (code segment identity, LOOP position). Loops that can't
+        # be compiled map to a _Loop without a function.
+        self.loops = {}
+        self.vm = None
+
+    def back_edge(self, func_obj) -> int:
+        """Called by the VM at a LOOP. Returns where to continue after running the
+        rest of the loop compiled, or None to take the back edge as usual."""
+        key = (id(func_obj.code_segment), func_obj.ip)
+        loop = self.loops.get(key)
+        if loop is None:
+            count = self.counts.get(key, 0) + 1
+            self.counts[key] = count
+            if count < self.threshold:
+                return None
+            loop = self.loops[key] = self.compile(func_obj, specialize=True)
+        # A loop inside an inlined call can hold values on the operand stack.
+        if loop.function is None or func_obj.operand_stack:
+            return None
+        try:
+            exit_ip = loop.function(func_obj)
+        except RuntimeError as e:
+            # For the inlined functions in the stack trace.
+            ip = loop.error_ip(e.__traceback__)
+            if ip is not None:
+                func_obj.ip = ip
+            raise
+        if exit_ip is None:
+            # The locals' types changed since the loop was compiled: from now on run
+            # a version that checks types as it goes.
+            loop.guard_failures += 1
+            self.loops[key] = self.compile(func_obj, specialize=False, previous=loop)
+            return None
+        loop.runs += 1
+        return exit_ip
+
+    def register_function(self, func_decl) -> RegisterFunction:
+        function = self.register_code.get(func_decl.name)
+        if function is None:
+            original = copy.copy(func_decl)
+            original.code_segment = self.originals[id(func_decl.code_segment)][1]
+            functions = {name: RegisterFunction(decl) for name, decl in self.func_decls.items()}
+            function = compile_function(original, functions)
+            self.register_code[func_decl.name] = function
+        return function
+
+    def compile(self, func_obj, specialize: bool, previous: _Loop=None) -> _Loop:
+        func_decl, code_segment = self.originals[id(func_obj.code_segment)]
+        loop_ip = func_obj.ip
+        header_ip = loop_ip + 1 - code_segment[loop_ip + 1]
+        loop = _Loop(func_decl.name, header_ip)
+        if previous is not None:
+            loop.runs = previous.runs
+            loop.guard_failures = previous.guard_failures
+        try:
+            function = self.register_function(func_decl)
+        except ValueError:
+            return loop
+        start, end = function.pc_at_ip[header_ip], function.pc_at_ip[loop_ip + 2]
+        loop_code, loop.ips = self.extract(function, start, end)
+
+        used = sorted({register for ins in loop_code.code for register in registers_of(ins)
+                       if register < len(function.local_names)})
+        written = sorted({ins[1] for ins in loop_code.code
+                          if ins[0] in WRITES and ins[1] < len(function.local_names)})
+        types = self.infer_types(loop_code, func_obj.locals, used) if specialize else {}
+        loop.types = {function.local_names[slot]: kind.__name__ for slot, kind in types.items()
+                      if slot < len(function.local_names) and slot in used}
+
+        constants = {}
+        lines = []
+        generator = _LoopGenerator(loop_code, self.func_decls, types, constants, lines, loop.line_pcs)
+        try:
+            generator.generate('loop', used, written)
+        except ValueError:
+            return loop
+        loop.filename = f'<loop {func_decl.name}:{header_ip}>'
+        namespace = runtime_namespace(self.vm, self.sleep)
+        namespace['call'] = self.vm.call
+        namespace.update(constants)
+        exec(compile('\n'.join(lines) + '\n', loop.filename, 'exec'), namespace)
+        loop.function = namespace['loop']
+        return loop
+
+    def extract(self, function: RegisterFunction, start: int, end: int):
+        """The register code of `function[start:end]` on its own, with the
+        positions of its instructions in the code segment. Branches out of it,
+        returns and tail calls become EXITs back to the stack VM."""
+        code = []
+        ips = []
+        exits = {}
+        for pc in range(start, end):
+            ins = function.code[pc]
+            op = ins[0]
+            if op in BRANCHES:
+                target = ins[-1]
+                if start <= target < end:
+                    ins = (*ins[:-1], target - start)
+                else:
+                    exits.setdefault(target, []).append(len(code))
+            elif op == RegOp.RET:
+                ins = (RegOp.EXIT, function.ips[pc], (ins[1],))
+            elif op == RegOp.TAIL_CALL:
+                ins = (RegOp.EXIT, function.ips[pc], ins[2])
+            code.append(ins)
+            ips.append(function.ips[pc])
+        for target, sources in exits.items():
+            ip, depth = function.targets[target]
+            for source in sources:
+                code[source] = (*code[source][:-1], len(code))
+            code.append((RegOp.EXIT, ip, tuple(range(function.temp_base, function.temp_base + depth))))
+            ips.append(ip)
+        loop_code = copy.copy(function)
+        loop_code.code = code
+        return loop_code, ips
+
+    @staticmethod
+    def infer_types(loop_code: RegisterFunction, entry: list, used: list) -> dict:
+        """The type of every register that holds the same type of value throughout
+        the loop, given the locals' values on entry."""
+        local_count = len(loop_code.local_names)
+        types = {slot: type(entry[slot]) if entry[slot] is not UNDEFINED else None for slot in used}
+
+        def type_of(register):
+            if local_count <= register < loop_code.temp_base:
+                return type(loop_code.template[register])
+            return types.get(register, UNWRITTEN)
+
+        writes = [ins for ins in loop_code.code if ins[0] in WRITES]
+        changed = True
+        while changed:
+            changed = False
+            for ins in writes:
+                # Operands not written yet are typed by a later pass.
+                if any(type_of(register) is UNWRITTEN for register in registers_of(ins)[1:]):
+                    continue
+                kind = result_type(ins, type_of)
+                old = types.get(ins[1], UNWRITTEN)
+                new = kind if old is UNWRITTEN or old == kind else None
+                if new != old:
+                    types[ins[1]] = new
+                    changed = True
+        for ins in writes:
+            if any(type_of(register) is UNWRITTEN for register in registers_of(ins)[1:]):
+                types[ins[1]] = None
+        return {register: kind for register, kind in types.items() if kind not in (None, UNWRITTEN)}
+
+    def sleep(self, amount):
+        self.vm.output.flush()
+        if not is_number(amount):
+            raise RuntimeError(f"Sleep duration must by of type `number` not `{type_name(amount)}`.")
+        time.sleep(amount)
+
+    def report(self, file=sys.stderr):
+        print("Compiled loops:", file=file)
+        print(f"\t{'runs':>8}  {'guard failures':>14}  loop", file=file)
+        for loop in sorted(self.loops.values(), key=lambda loop: (loop.name, loop.header_ip)):
+            if loop.function is None:
+                where = 'not compiled'
+            elif loop.types:
+                where = ', '.join(f'{name}: {kind}' for name, kind in sorted(loop.types.items()))
+            else:
+                where = 'generic'
+            print(f"\t{loop.runs:>8}  {loop.guard_failures:>14}  {loop.name} at {loop.header_ip} ({where})", file=file)
@@ -0,0 +1,89 @@
+from collections import OrderedDict
+from instructions import OpCode, decode
+from values import ListValue
+import sys
+
+# Instructions whose effect is visible outside the call.
+IMPURE_OPS = {OpCode.PRINT, OpCode.PRINTLN, OpCode.SLEEP, OpCode.CLRSCRN,
+              OpCode.APPEND, OpCode.STORE_SUBSCRIPT}
+
+# Returned by `FunctionCache.lookup` when the call has to run.
+MISS = object()
+
+def called_functions(instructions: list) -> set:
+    # Runs on linked code, where a call's first operand is the called FunctionDeclaration.
+    return {instruction.operands[0].name for instruction in instructions
+            if instruction.op in (OpCode.CALL, OpCode.TAIL_CALL)}
+
+def has_side_effects(instruction) -> bool:
+    if instruction.op == OpCode.CALL_NATIVE:
+        return not instruction.operands[0].pure
+    return instruction.op in IMPURE_OPS
+
+def pure_functions(func_decls: dict) -> set:
+    """Names of the functions that have no side effects and only call other pure
+    functions. `func_decls` must be linked. Mutually recursive functions are pure unless one of them isn't."""
+    pure = set()
+    calls = {}
+    for name, func_decl in func_decls.items():
+        instructions = decode(func_decl.code_segment)
+        if not any(has_side_effects(instruction) for instruction in instructions):
+            pure.add(name)
+            calls[name] = called_functions(instructions)
+
+    changed = True
+    while changed:
+        changed = False
+        for name in list(pure):
+            if not calls[name] <= pure:
+                pure.remove(name)
+                changed = True
+    return pure
+
+
+class FunctionCache:
+    """Least recently used return values of one function, keyed by its arguments."""
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        value = self.entries.get(key, MISS)
+        if value is MISS:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def store(self, key, value):
+        # Lists are mutable, so every call has to build its own.
+        if isinstance(value, ListValue):
+            return
+        self.entries[key] = value
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+
+class Memoizer:
+    """Caches the return values of the pure functions in `func_decls`."""
+    def __init__(self, func_decls: dict, max_size: int=1024):
+        self.caches = {name: FunctionCache(max_size) for name in pure_functions(func_decls)
+                       if name != 'main'}
+
+    @staticmethod
+    def key(args: list):
+        # The types are part of the key so that e.g. `true` and `1` don't share an entry.
+        # Returns None for calls that can't be cached because an argument is a list.
+        for arg in args:
+            if isinstance(arg, ListValue):
+                return None
+        return (*args, *map(type, args))
+
+    def report(self, file=sys.stderr):
+        print("Memoized functions:", file=file)
+        print(f"\t{'hits':>12}  {'misses':>12}  {'entries':>8}  function", file=file)
+        for name, cache in sorted(self.caches.items()):
+            print(f"\t{cache.hits:>12}  {cache.misses:>12}  {len(cache.entries):>8}  {name}", file=file)
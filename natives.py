@@ -0,0 +1,47 @@
+from parallel import spawn, join, parallel_map
+import grids
+
+class Native:
+    """A function built into the interpreter. Scripts call it like one of their own
+    functions, unless they define a function of the same name. `function` takes
+    the running VM and the list of arguments and returns the call's value."""
+    def __init__(self, name: str, function, arg_count: int, variadic: bool=False, pure: bool=True):
+        self.name = name
+        self.function = function
+        # The number of arguments, or the least number if `variadic`.
+        self.arg_count = arg_count
+        self.variadic = variadic
+        # Pure natives have no effect besides returning a value; see `memo.py`.
+        self.pure = pure
+
+    def accepts(self, arg_count: int):
+        return arg_count >= self.arg_count if self.variadic else arg_count == self.arg_count
+
+    def expected_args(self) -> str:
+        return f"at least `{self.arg_count}`" if self.variadic else f"`{self.arg_count}`"
+
+    def __repr__(self) -> str:
+        return f'<native {self.name}>'
+
+
+NATIVES = {native.name: native for native in [
+    Native('spawn', spawn, 1, variadic=True, pure=False),
+    Native('join',  join,  1, pure=False),
+    Native('pmap',  parallel_map, 2, pure=False),
+    Native('grid',        grids.grid, 2, variadic=True),
+    Native('grid_copy',   grids.grid_copy, 1),
+    Native('grid_sum',    grids.grid_sum, 1),
+    Native('grid_count',  grids.grid_count, 2),
+    Native('grid_add',    grids.grid_add, 2),
+    Native('grid_sub',    grids.grid_sub, 2),
+    Native('grid_mul',    grids.grid_mul, 2),
+    Native('grid_div',    grids.grid_div, 2),
+    Native('grid_mod',    grids.grid_mod, 2),
+    Native('grid_eq',     grids.grid_eq, 2),
+    Native('grid_lt',     grids.grid_lt, 2),
+    Native('grid_le',     grids.grid_le, 2),
+    Native('grid_gt',     grids.grid_gt, 2),
+    Native('grid_ge',     grids.grid_ge, 2),
+    Native('grid_select', grids.grid_select, 3),
+    Native('neighbors',   grids.neighbors, 2),
+]}
@@ -0,0 +1,263 @@
+from instructions import OpCode, Instruction, decode, encode
+from vm import add, sub, mul, div, mod, negate, comparision, COMPARISONS
+
+CONSTANTS = {OpCode.NUMBER, OpCode.STRING, OpCode.TRUE, OpCode.FALSE, OpCode.NULL}
+
+BINARY_FOLDS = {
+    OpCode.ADD:           add,
+    OpCode.SUB:           sub,
+    OpCode.MUL:           mul,
+    OpCode.DIV:           div,
+    OpCode.MODULO:        mod,
+    OpCode.EQUAL_EQUAL:   lambda a, b: a == b,
+    OpCode.GREATER:       lambda a, b: comparision(a, b, '>'),
+    OpCode.GREATER_EQUAL: lambda a, b: comparision(a, b, '>='),
+    OpCode.LESS:          lambda a, b: comparision(a, b, '<'),
+    OpCode.LESS_EQUAL:    lambda a, b: comparision(a, b, '<='),
+}
+
+UNARY_FOLDS = {
+    OpCode.NEGATION: negate,
+}
+
+UNCONDITIONAL_JUMPS = {OpCode.JUMP, OpCode.LOOP}
+CONDITIONAL_JUMPS = {OpCode.JUMP_FALSE, OpCode.JUMP_TRUE}
+# Instructions whose result is always a bool.
+BOOL_RESULTS = {OpCode.TRUE, OpCode.FALSE, OpCode.NOT, OpCode.EQUAL_EQUAL, OpCode.GREATER,
+                OpCode.GREATER_EQUAL, OpCode.LESS, OpCode.LESS_EQUAL}
+# Instructions after which execution never falls through to the next one.
+TERMINATORS = UNCONDITIONAL_JUMPS | {OpCode.RET, OpCode.TAIL_CALL}
+
+
+def constant_value(instruction: Instruction):
+    match instruction.op:
+        case OpCode.NUMBER | OpCode.STRING:
+            return instruction.operands[0]
+        case OpCode.TRUE:
+            return True
+        case OpCode.FALSE:
+            return False
+    return None
+
+def constant_instruction(value, into: Instruction):
+    """Rewrites `into` in place so jumps that target it stay valid."""
+    if isinstance(value, bool):
+        into.op, into.operands = (OpCode.TRUE if value else OpCode.FALSE), []
+    elif isinstance(value, (int, float)):
+        into.op, into.operands = OpCode.NUMBER, [value]
+    elif isinstance(value, str):
+        into.op, into.operands = OpCode.STRING, [value]
+    else:
+        into.op, into.operands = OpCode.NULL, []
+
+
+class _Optimizer:
+    def __init__(self, instructions: list[Instruction]):
+        self.instructions = instructions
+
+    def jump_targets(self):
+        return {id(instruction.target) for instruction in self.instructions 
+                if instruction.target is not None}
+
+    def fold_constants(self):
+        # Folds over the already-folded output so `2 * 3 + 4` collapses in one pass.
+        # Nothing is folded across a jump target, since another path may reach it
+        # with different values on the stack. Folds that would raise are left for
+        # the VM to report at runtime.
+        targets = self.jump_targets()
+        changed = False
+        output = []
+        for index, instruction in enumerate(self.instructions):
+            output.append(instruction)
+            if id(instruction) in targets:
+                continue
+            op = instruction.op
+            if op in BINARY_FOLDS and len(output) >= 3:
+                a, b = output[-3], output[-2]
+                if a.op in CONSTANTS and b.op in CONSTANTS and id(b) not in targets:
+                    try:
+                        value = BINARY_FOLDS[op](constant_value(a), constant_value(b))
+                    except (RuntimeError, ArithmeticError):
+                        continue
+                    constant_instruction(value, a)
+                    del output[-2:]
+                    changed = True
+            elif (op in UNARY_FOLDS or op == OpCode.NOT) and len(output) >= 2:
+                a = output[-2]
+                if op == OpCode.NOT and a.op in (OpCode.TRUE, OpCode.FALSE):
+                    constant_instruction(a.op == OpCode.FALSE, a)
+                    del output[-1]
+                    changed = True
+                elif op in UNARY_FOLDS and a.op in CONSTANTS:
+                    try:
+                        value = UNARY_FOLDS[op](constant_value(a))
+                    except (RuntimeError, ArithmeticError):
+                        continue
+                    constant_instruction(value, a)
+                    del output[-1]
+                    changed = True
+            elif op in CONDITIONAL_JUMPS and len(output) >= 2:
+                a = output[-2]
+                if a.op in (OpCode.TRUE, OpCode.FALSE):
+                    taken = (a.op == OpCode.TRUE) == (op == OpCode.JUMP_TRUE)
+                    # A condition that never jumps becomes a jump to the next
+                    # instruction, which `remove_dead_code` then drops.
+                    target = instruction.target if taken else self.instructions[index + 1]
+                    a.op, a.operands, a.target = OpCode.JUMP, [0], target
+                    del output[-1]
+                    changed = True
+        self.instructions = output
+        return changed
+
+    def invert_conditions(self):
+        # `NOT JUMP_FALSE` becomes `JUMP_TRUE` and vice versa, when the NOT's operand
+        # is known to be a bool: for anything else NOT reports its own error, which
+        # the jump wouldn't.
+        targets = self.jump_targets()
+        changed = False
+        output = []
+        for instruction in self.instructions:
+            if (instruction.op in CONDITIONAL_JUMPS and len(output) >= 2
+                    and output[-1].op == OpCode.NOT and output[-2].op in BOOL_RESULTS
+                    and id(instruction) not in targets and id(output[-1]) not in targets):
+                not_op = output[-1]
+                not_op.op = OpCode.JUMP_TRUE if instruction.op == OpCode.JUMP_FALSE else OpCode.JUMP_FALSE
+                not_op.operands = [0]
+                not_op.target = instruction.target
+                changed = True
+                continue
+            output.append(instruction)
+        self.instructions = output
+        return changed
+
+    def thread_jumps(self):
+        changed = False
+        for instruction in self.instructions:
+            if instruction.target is None:
+                continue
+            seen = set()
+            target = instruction.target
+            while target.op in UNCONDITIONAL_JUMPS and id(target) not in seen:
+                seen.add(id(target))
+                target = target.target
+            if target is not instruction.target:
+                instruction.target = target
+                changed = True
+        return changed
+
+    def remove_dead_code(self):
+        # Keeps only what is reachable from the entry point. Jumps to the next
+        # instruction are dropped too, by treating them as plain fall-through.
+        position = {id(instruction): index for index, instruction in enumerate(self.instructions)}
+        reachable = set()
+        pending = [0]
+        while pending:
+            index = pending.pop()
+            while index < len(self.instructions) and index not in reachable:
+                reachable.add(index)
+                instruction = self.instructions[index]
+                if instruction.target is not None:
+                    pending.append(position[id(instruction.target)])
+                if instruction.op in TERMINATORS:
+                    break
+                index += 1
+
+        output = []
+        for index, instruction in enumerate(self.instructions):
+            if index not in reachable:
+                continue
+            if (instruction.op in UNCONDITIONAL_JUMPS and index + 1 < len(self.instructions)
+                    and instruction.target is self.instructions[index + 1]):
+                continue
+            output.append(instruction)
+
+        changed = len(output) != len(self.instructions)
+        if changed:
+            # A dropped jump-to-next may itself be a jump target.
+            kept = {id(instruction) for instruction in output}
+            for instruction in output:
+                while instruction.target is not None and id(instruction.target) not in kept:
+                    instruction.target = self.instructions[position[id(instruction.target)] + 1]
+        self.instructions = output
+        return changed
+
+    def mark_tail_calls(self):
+        # A CALL directly followed by RET returns whatever the callee returns, so the
+        # VM can run the callee in the caller's frame. The RET stays in place for
+        # other jumps to it; `remove_dead_code` drops it otherwise.
+        changed = False
+        for instruction, next_instruction in zip(self.instructions, self.instructions[1:]):
+            if instruction.op == OpCode.CALL and next_instruction.op == OpCode.RET:
+                instruction.op = OpCode.TAIL_CALL
+                changed = True
+        return changed
+
+    def fuse(self):
+        # Replaces the instruction sequences that the parser emits for loop counters
+        # and loop conditions with single superinstructions. The first
+        # instruction of a sequence is rewritten in place so jumps to it stay valid;
+        # the rest must not be jump targets.
+        targets = self.jump_targets()
+        output = []
+        index = 0
+        while index < len(self.instructions):
+            instruction = self.instructions[index]
+            length = self.fuse_at(index, targets)
+            output.append(instruction)
+            index += length
+        self.instructions = output
+
+    def fuse_at(self, index, targets):
+        """Fuses the sequence starting at `index` into its first instruction and
+        returns how many instructions it consumed."""
+        window = self.instructions[index:index + 5]
+        ops = [instruction.op for instruction in window]
+        first = window[0]
+        if first.op != OpCode.LOAD_LOCAL or any(id(instruction) in targets for instruction in window[1:4]):
+            return 1
+        slot = first.operands[0]
+
+        # `x = x + 1` / `x = x - 1`
+        if ops[1:4] == [OpCode.NUMBER, OpCode.ADD, OpCode.STORE_LOCAL] or \
+                ops[1:4] == [OpCode.NUMBER, OpCode.SUB, OpCode.STORE_LOCAL]:
+            if window[3].operands[0] == slot:
+                first.op = OpCode.INC_LOCAL if ops[2] == OpCode.ADD else OpCode.DEC_LOCAL
+                first.operands = [slot, window[1].operands[0]]
+                return 4
+
+        # `x < 10` / `x < y` as a branch condition
+        if len(ops) >= 4 and ops[1] in (OpCode.NUMBER, OpCode.LOAD_LOCAL) and \
+                ops[2] in COMPARISONS and ops[3] == OpCode.JUMP_FALSE:
+            if ops[1] == OpCode.NUMBER:
+                first.op = OpCode.COMPARE_LOCAL_CONST_JUMP
+            else:
+                first.op = OpCode.COMPARE_LOCALS_JUMP
+            first.operands = [slot, window[1].operands[0], ops[2], 0]
+            first.target = window[3].target
+            return 4
+        return 1
+
+    def optimize(self, level):
+        changed = True
+        while changed:
+            changed = self.fold_constants()
+            changed |= self.invert_conditions()
+            changed |= self.thread_jumps()
+            changed |= self.mark_tail_calls()
+            changed |= self.remove_dead_code()
+        if level >= 2:
+            self.fuse()
+        return self.instructions
+
+
+def optimize(function_declarations: dict, level: int):
+    """Rewrites every function's code segment in place. Level 0 leaves the bytecode
+    untouched. Level 1 folds constants, inverts `not` conditions, threads jumps, turns
+    calls in tail position into tail calls and removes unreachable code. Level 2 also fuses common instruction sequences into 
+    superinstructions."""
+    if level <= 0:
+        return function_declarations
+    for func_decl in function_declarations.values():
+        instructions = _Optimizer(decode(func_decl.code_segment)).optimize(level)
+        func_decl.code_segment = encode(instructions)
+    return function_declarations
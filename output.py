@@ -0,0 +1,33 @@
+import sys
+
+# Clears the terminal and moves the cursor home, without spawning `clear`.
+CLEAR_SCREEN = '\033[2J\033[H'
+
+class OutputWriter:
+    """Collects the program's output and writes it to `sink` in large chunks.
+    The buffer is flushed when it reaches `buffer_size` characters, and whenever
+    the VM is about to sleep, clears the screen or exits."""
+    def __init__(self, sink=None, buffer_size=1 << 16):
+        # With no sink, output goes to whatever `sys.stdout` is at flush time.
+        self.sink = sink
+        self.buffer_size = buffer_size
+        self.parts = []
+        self.size = 0
+
+    def write(self, text: str):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        sink = self.sink if self.sink is not None else sys.stdout
+        if self.parts:
+            sink.write(''.join(self.parts))
+            self.parts.clear()
+            self.size = 0
+        sink.flush()
+
+    def clear_screen(self):
+        self.write(CLEAR_SCREEN)
+        self.flush()
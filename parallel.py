@@ -0,0 +1,219 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from array import array
+from loop_compiler import LoopCompiler
+from memo import Memoizer
+from output import OutputWriter
+from values import ListValue, type_name
+from vm import VM
+import io
+import math
+import os
+import pickle
+import sys
+
+# `spawn` and `pmap` run calls to script functions in a pool of worker processes.
+# Each worker gets the linked function declarations once, when it starts, and runs
+# the calls on a stack VM of its own. Arguments and return values are copied
+# between processes by pickling them, so a spawned call works on its own copy of
+# any list passed to it. What a spawned call prints is written out when it's joined.
+
+# Types of the values that can be copied to and from a worker.
+COPYABLE_TYPES = (int, float, str, bool, type(None))
+
+def check_copyable(values, seen=None):
+    """Raises if `values` hold something that only makes sense in this process."""
+    seen = set() if seen is None else seen
+    for value in values:
+        if isinstance(value, ListValue):
+            if id(value) not in seen and type(value.items) is not array:
+                seen.add(id(value))
+                check_copyable(value.items, seen)
+        elif type(value) not in COPYABLE_TYPES:
+            raise RuntimeError(f"Can't copy a value of type `{type_name(value)}` to another process.")
+
+def called_function(vm, name, arg_count: int):
+    if type(name) is not str:
+        raise RuntimeError(f"Expect the name of a function, not a value of type `{type_name(name)}`.")
+    func_decl = vm.func_decls.get(name)
+    if func_decl is None:
+        raise RuntimeError(f"Undefined function `{name}`.")
+    if len(func_decl.params) != arg_count:
+        raise RuntimeError(f"Function `{name}` expects `{len(func_decl.params)}` # of params " +
+                           f"but got `{arg_count}`.")
+    return func_decl
+
+def run_calls(vm: VM, name: str, args_list: list):
+    """Calls `name` with each of `args_list` on `vm`. Returns the return values and,
+    if a call fails, its error message and stack trace."""
+    func_decl = vm.func_decls[name]
+    depth = len(vm.call_trace_stack)
+    values = []
+    try:
+        for args in args_list:
+            values.append(vm.call(func_decl, args))
+    except RuntimeError as e:
+        trace = vm.call_trace_stack[depth:]
+        del vm.call_trace_stack[depth:]
+        return values, (str(e), trace)
+    return values, None
+
+
+# The VM of a worker process, made by `start_worker`.
+worker_vm = None
+
+def start_worker(func_decls: dict, memoize: bool, tier_threshold: int):
+    global worker_vm
+    memoizer = Memoizer(func_decls) if memoize else None
+    loop_compiler = LoopCompiler(func_decls, tier_threshold) if tier_threshold is not None else None
+    # Calls spawned by a worker run in the worker itself.
+    worker_vm = VM(func_decls, output=OutputWriter(io.StringIO()), memoizer=memoizer,
+                   loop_compiler=loop_compiler, workers=Workers(func_decls, 0))
+    if loop_compiler is not None:
+        # As in `VM.run`.
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), 1_000_000))
+
+def run_in_worker(name: str, args_list: list):
+    values, error = run_calls(worker_vm, name, args_list)
+    if error is None:
+        try:
+            check_copyable(values)
+        except RuntimeError as e:
+            values, error = [], (str(e), [name])
+    output = worker_vm.output
+    output.flush()
+    text = output.sink.getvalue()
+    output.sink.seek(0)
+    output.sink.truncate()
+    return values, error, text
+
+
+class _Deferred:
+    """Calls that run in this process when their result is asked for, in place of a
+    future of `run_in_worker`."""
+    def __init__(self, vm: VM, name: str, args_list: list):
+        self.vm = vm
+        self.name = name
+        self.args_list = args_list
+
+    def result(self):
+        return (*run_calls(self.vm, self.name, self.args_list), '')
+
+    def cancel(self):
+        pass
+
+
+class Workers:
+    """The worker processes of a run, started when first needed. With `max_workers`
+    0, calls run in the calling process instead, one at a time as they're joined;
+    workers run the calls they spawn themselves that way."""
+    def __init__(self, func_decls: dict, max_workers: int=None, memoize: bool=True,
+                 tier_threshold: int=1000):
+        self.func_decls = func_decls
+        self.max_workers = max_workers if max_workers is not None else os.cpu_count() or 1
+        self.memoize = memoize
+        # None turns tiering off in the workers.
+        self.tier_threshold = tier_threshold
+        self.executor = None
+
+    def submit(self, vm, name: str, args_list: list):
+        """Starts calling `name` with each of `args_list`. Returns a future of the
+        return values, the error if a call failed, and the calls' output."""
+        if self.max_workers == 0:
+            # Copied, like arguments sent to a worker.
+            return _Deferred(vm, name, pickle.loads(pickle.dumps(args_list)))
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.max_workers, initializer=start_worker,
+                                                initargs=(self.func_decls, self.memoize,
+                                                          self.tier_threshold))
+        return self.executor.submit(run_in_worker, name, args_list)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+
+def workers_of(vm) -> Workers:
+    if vm.workers is None:
+        vm.workers = Workers(vm.func_decls)
+    return vm.workers
+
+def collect(vm, name: str, future) -> list:
+    """Writes out the output of the calls behind `future` and returns their values,
+    or raises the error one of them stopped with."""
+    try:
+        values, error, output = future.result()
+    except BrokenProcessPool:
+        raise RuntimeError(f"A worker process running `{name}` stopped unexpectedly.")
+    vm.output.write(output)
+    if error is not None:
+        message, trace = error
+        frames = ''.join(f"\n\t <{frame}>" for frame in trace)
+        raise RuntimeError(f"{message}\nStack trace in the worker:{frames}")
+    return values
+
+
+class Task:
+    """What `spawn` returns: a call running in a worker process."""
+    __slots__ = ('name', 'future', 'value', 'error')
+
+    def __init__(self, name: str, future):
+        self.name = name
+        self.future = future
+        self.value = None
+        # The error the call stopped with, raised again by every join.
+        self.error = None
+
+    def __repr__(self) -> str:
+        return f'<task {self.name}>'
+
+
+def spawn(vm, args: list):
+    """`spawn(name, args...)` starts the call `name(args...)` in a worker."""
+    name, call_args = args[0], args[1:]
+    called_function(vm, name, len(call_args))
+    check_copyable(call_args)
+    return Task(name, workers_of(vm).submit(vm, name, [call_args]))
+
+def join(vm, args: list):
+    """`join(task)` waits for a spawned call and returns its value. Joining a task
+    again returns the same value, or raises the same error."""
+    task = args[0]
+    if not isinstance(task, Task):
+        raise RuntimeError(f"Can't join a value of type `{type_name(task)}`.")
+    if task.future is not None:
+        # Cleared first, so that the call's output is written out only once.
+        future, task.future = task.future, None
+        try:
+            task.value = collect(vm, task.name, future)[0]
+        except RuntimeError as error:
+            task.error = error
+    if task.error is not None:
+        raise RuntimeError(*task.error.args)
+    return task.value
+
+def parallel_map(vm, args: list):
+    """`pmap(name, list)` returns the list of `name(item)` for each item of `list`,
+    called in chunks spread across the workers."""
+    name, items = args
+    if not isinstance(items, ListValue):
+        raise RuntimeError(f"Can't map over a value of type `{type_name(items)}`.")
+    called_function(vm, name, 1)
+    items = items.as_list()
+    check_copyable(items)
+    workers = workers_of(vm)
+    # A few chunks per worker, so that a worker that gets the quick calls takes
+    # over some of the rest.
+    size = max(1, math.ceil(len(items) / (4 * max(workers.max_workers, 1))))
+    futures = [workers.submit(vm, name, [[item] for item in items[start:start + size]])
+               for start in range(0, len(items), size)]
+    values = []
+    try:
+        for future in futures:
+            values.extend(collect(vm, name, future))
+    except RuntimeError:
+        for future in futures:
+            future.cancel()
+        raise
+    return ListValue(values)
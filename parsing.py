@@ -1,19 +1,32 @@
 from instructions import OpCode
-from tokenization import TokenType
+from tokenization import Token, TokenType
+from typing import Iterable
 import sys
 
 class FunctionDeclaration:
-    def __init__(self, params, code_segment):
+    def __init__(self, name, params, code_segment, local_names):
+        self.name = name
         self.params = params
         self.code_segment = code_segment
+        # Slot `i` of a frame holds the variable `local_names[i]`. 
+        # Parameters occupy the first slots.
+        self.local_names = local_names
+        # (start, end, name) for each range of the code segment that holds an
+        # inlined call to `name`.
+        self.inlined = []
 
 
 class _Parser:
-    def __init__(self, tokens: list):
-        self.tokens = tokens
-        self.index = 0
+    def __init__(self, tokens: Iterable[Token]):
+        # Tokens are pulled one at a time, so `tokens` can be a lazy stream from
+        # `tokenize_stream`. Only the current and the previous token are kept.
+        self.tokens = iter(tokens)
+        self.current_token = next(self.tokens)
+        self.previous_token = None
         self.function_declarations = {}
         self.current_function: list
+        self.current_locals: dict
+        self.local_names: list
         self.had_err = False
 
     def parse_error(self, error_msg):
@@ -24,6 +37,12 @@ class _Parser:
     def emit_op(self, op):
         self.current_function.append(op)
 
+    def local_slot(self, iden: str):
+        if iden not in self.current_locals:
+            self.current_locals[iden] = len(self.local_names)
+            self.local_names.append(iden)
+        return self.current_locals[iden]
+
     def at_end(self):
         return self.peek().tok_type == TokenType.EOF
     
@@ -63,10 +82,19 @@ class _Parser:
         if not self.check(TokenType.LEFT_BRACE):
             params = self.parameters()
 
+        self.local_names = list(params)
+        self.current_locals = {}
+        for slot, param in enumerate(params):
+            self.current_locals[param] = slot
+
         self.consume(TokenType.LEFT_BRACE, "Expect `{` after after function name.")
         self.block()
+        # Falling off the end of a function returns null.
+        self.emit_op(OpCode.NULL)
+        self.emit_op(OpCode.RET)
 
-        self.function_declarations[iden] = FunctionDeclaration(params, self.current_function)
+        self.function_declarations[iden] = FunctionDeclaration(iden, params, self.current_function,
+                                                               self.local_names)
     
     def parameters(self):
         params = []
@@ -98,6 +126,8 @@ class _Parser:
             iden = self.previous()
             if self.match(TokenType.LEFT_PAREN):
                 self.call(iden.lexeme)
+                # A call statement discards the return value.
+                self.emit_op(OpCode.POP)
             else:
                 self.assignment()
         elif self.match(TokenType.RETURN):
@@ -173,31 +203,62 @@ class _Parser:
         else:
             self.expression()
 
-        self.emit_op(OpCode.IDENTIFIER)            
-        self.emit_op(identifier.lexeme)
-        self.emit_op(OpCode.ASSIGNMENT)
-        while subscript_level > 0:
-            self.emit_op(OpCode.SUBSCRIPT)
-            subscript_level -= 1
+        if subscript_level > 0:
+            self.emit_op(OpCode.STORE_SUBSCRIPT)
+            self.emit_op(self.local_slot(identifier.lexeme))
+            self.emit_op(subscript_level)
+        else:
+            self.emit_op(OpCode.STORE_LOCAL)
+            self.emit_op(self.local_slot(identifier.lexeme))
     
     def list(self):
+        start_index = len(self.current_function)
         list_items_count = 0
-        def parse_list():
-            nonlocal list_items_count
-            if self.match(TokenType.NEWLINE):
-                parse_list()
-            elif self.match(TokenType.COMMA):
-                parse_list()
-            elif self.match(TokenType.RIGHT_BRACKET):
-                return
+        while not self.match(TokenType.RIGHT_BRACKET):
+            if self.match(TokenType.NEWLINE, TokenType.COMMA):
+                continue
+            self.list_item()
+            list_items_count += 1
+
+        template = self.constant_list(start_index)
+        if template is not None:
+            # Replaces the item pushes with one prebuilt list the VM copies.
+            del self.current_function[start_index:]
+            self.emit_op(OpCode.LIST_CONST)
+            self.emit_op(template)
+        else:
+            self.emit_op(OpCode.LIST)
+            self.emit_op(list_items_count)
+
+    def constant_list(self, start_index):
+        """Returns the items emitted since `start_index` as a list if they are all
+        literals, or None if any of them has to be computed at runtime."""
+        items = []
+        code = self.current_function
+        ip = start_index
+        while ip < len(code):
+            op = code[ip]
+            if op in (OpCode.NUMBER, OpCode.STRING, OpCode.LIST_CONST):
+                value = code[ip + 1]
+                ip += 2
+            elif op in self.keyword_values:
+                value = self.keyword_values[op]
+                ip += 1
             else:
-                self.list_item()
-                list_items_count += 1
-                parse_list()
-        
-        parse_list()
-        self.emit_op(OpCode.LIST)
-        self.emit_op(list_items_count)
+                return None
+            if ip < len(code) and code[ip] == OpCode.NEGATION:
+                if op != OpCode.NUMBER:
+                    return None
+                value = -value
+                ip += 1
+            items.append(value)
+        return items
+
+    keyword_values = {
+        OpCode.TRUE:  True,
+        OpCode.FALSE: False,
+        OpCode.NULL:  None,
+    }
 
     def list_item(self):
         if self.match(TokenType.LEFT_BRACKET):
@@ -235,8 +296,8 @@ class _Parser:
         self.consume(TokenType.IDENTIFIER, "Expect identifier after append.")
         iden = self.previous()
         self.expression()
-        self.emit_op(OpCode.IDENTIFIER)
-        self.emit_op(iden.lexeme)
+        self.emit_op(OpCode.LOAD_LOCAL)
+        self.emit_op(self.local_slot(iden.lexeme))
         self.emit_op(OpCode.APPEND)
     
     def match(self, *token_types):
@@ -253,14 +314,15 @@ class _Parser:
 
     def advance(self):
         if not self.at_end():
-            self.index += 1
+            self.previous_token = self.current_token
+            self.current_token = next(self.tokens)
         return self.previous()
     
     def previous(self):
-        return self.tokens[self.index - 1]
+        return self.previous_token
         
     def peek(self):
-        return self.tokens[self.index]
+        return self.current_token
     
     def call(self, iden: str):
         list_items_count = 0 
@@ -271,13 +333,12 @@ class _Parser:
                 break
             self.consume(TokenType.COMMA, "Expect `,` to seperate arguments.")
 
-        self.emit_op(OpCode.LIST) 
-        self.emit_op(list_items_count)
-
         self.consume(TokenType.RIGHT_PAREN, "Expect `)` after function call.")
-        self.emit_op(OpCode.IDENTIFIER)
-        self.emit_op(iden)
+        # The arguments stay on the operand stack. `link` replaces the name with
+        # the called FunctionDeclaration.
         self.emit_op(OpCode.CALL)
+        self.emit_op(iden)
+        self.emit_op(list_items_count)
 
     def expression(self):
         self.Or()
@@ -412,15 +473,13 @@ class _Parser:
             self.subscript()
             subcript_level += 1
 
-        self.emit_op(OpCode.IDENTIFIER)
-        self.emit_op(iden.lexeme)
-
-
-        self.emit_op(OpCode.RESOLVE)
-        
-        while subcript_level > 0:
-            self.emit_op(OpCode.SUBSCRIPT)
-            subcript_level -= 1 
+        if subcript_level > 0:
+            self.emit_op(OpCode.LOAD_SUBSCRIPT)
+            self.emit_op(self.local_slot(iden.lexeme))
+            self.emit_op(subcript_level)
+        else:
+            self.emit_op(OpCode.LOAD_LOCAL)
+            self.emit_op(self.local_slot(iden.lexeme))
         
     def subscript(self):
         self.expression()
@@ -430,12 +489,13 @@ class _Parser:
         for func_name in self.function_declarations:
             print(func_name + ":")
             print("params:", self.function_declarations[func_name].params)
+            print("locals:", self.function_declarations[func_name].local_names)
             for op in self.function_declarations[func_name].code_segment:
                 print('\t', op)
             print('-' * 60)
 
 
-def parse(tokens: list):
+def parse(tokens: Iterable[Token]):
     parser = _Parser(tokens)
     parser.parse()
 
@@ -0,0 +1,86 @@
+from instructions import OpCode
+import json
+import sys
+import time
+
+class FunctionStats:
+    def __init__(self):
+        self.calls = 0
+        self.total_time = 0.0
+        self.self_time = 0.0
+
+
+class Profiler:
+    """Collects what the VM's instrumented dispatch loop reports: how often each opcode
+    runs, time spent per function, and how often each call site is taken."""
+    def __init__(self):
+        self.opcode_counts = [0] * (max(OpCode) + 1)
+        self.functions = {}
+        self.call_sites = {}
+        # One [name, start time, time spent in callees] entry per live frame.
+        self.active = []
+        # Live frame count per function, so recursive calls aren't counted twice
+        # in the total time.
+        self.depth = {}
+
+    def enter(self, func_name: str):
+        stats = self.functions.get(func_name)
+        if stats is None:
+            stats = self.functions[func_name] = FunctionStats()
+        stats.calls += 1
+        self.depth[func_name] = self.depth.get(func_name, 0) + 1
+        self.active.append([func_name, time.perf_counter(), 0.0])
+
+    def leave(self):
+        func_name, start, callee_time = self.active.pop()
+        elapsed = time.perf_counter() - start
+        stats = self.functions[func_name]
+        stats.self_time += elapsed - callee_time
+        self.depth[func_name] -= 1
+        if self.depth[func_name] == 0:
+            stats.total_time += elapsed
+        if self.active:
+            self.active[-1][2] += elapsed
+
+    def call_site(self, caller: str, ip: int, callee: str):
+        key = (caller, ip, callee)
+        self.call_sites[key] = self.call_sites.get(key, 0) + 1
+
+    def finish(self):
+        """Closes the frames still open when the program stopped, e.g. on a runtime error."""
+        while self.active:
+            self.leave()
+
+    def report(self, file=sys.stderr):
+        print("Opcodes:", file=file)
+        print(f"\t{'count':>12}  opcode", file=file)
+        for op, count in sorted(self.opcode_counts_by_name().items(), key=lambda item: -item[1]):
+            print(f"\t{count:>12}  {op}", file=file)
+
+        print("Functions:", file=file)
+        print(f"\t{'calls':>12}  {'total (s)':>10}  {'self (s)':>10}  function", file=file)
+        for name, stats in sorted(self.functions.items(), key=lambda item: -item[1].self_time):
+            print(f"\t{stats.calls:>12}  {stats.total_time:>10.4f}  {stats.self_time:>10.4f}  {name}", file=file)
+
+        print("Call sites:", file=file)
+        print(f"\t{'count':>12}  call", file=file)
+        for (caller, ip, callee), count in sorted(self.call_sites.items(), key=lambda item: -item[1]):
+            print(f"\t{count:>12}  {caller}@{ip} -> {callee}", file=file)
+
+    def opcode_counts_by_name(self):
+        return {OpCode(op).name: count for op, count in enumerate(self.opcode_counts) if count}
+
+    def write_json(self, path: str):
+        data = {
+            "opcodes": self.opcode_counts_by_name(),
+            "functions": {
+                name: {"calls": stats.calls, "total_time": stats.total_time, "self_time": stats.self_time}
+                for name, stats in self.functions.items()
+            },
+            "call_sites": [
+                {"caller": caller, "ip": ip, "callee": callee, "count": count}
+                for (caller, ip, callee), count in self.call_sites.items()
+            ],
+        }
+        with open(path, 'w') as file:
+            json.dump(data, file, indent=4)
@@ -0,0 +1,642 @@
+from enum import IntEnum, auto
+from instructions import OpCode, GENERIC_OPS, decode
+from output import OutputWriter
+from values import ListValue, display, is_number, type_name
+from vm import UNDEFINED, COMPARISONS, copy_template, add, sub, mul, div, mod, negate
+import time
+
+# Register instructions are tuples `(op, operands...)`. Operands name registers:
+# a frame's registers hold its locals, then its constants, then the temporaries
+# that take the place of the stack VM's operand stack.
+class RegOp(IntEnum):
+    MOVE            = auto()    # dst, src
+    ADD             = auto()    # dst, a, b
+    SUB             = auto()
+    MUL             = auto()
+    DIV             = auto()
+    MODULO          = auto()
+    COMPARE         = auto()    # dst, a, b, comparison function
+    NEGATE          = auto()    # dst, a
+    NOT             = auto()    # dst, a
+    LIST            = auto()    # dst, item registers
+    LIST_CONST      = auto()    # dst, template
+    LOAD_SUBSCRIPT  = auto()    # dst, list slot, index registers, list name
+    STORE_SUBSCRIPT = auto()    # list slot, index registers, value, list name
+    APPEND          = auto()    # list, value
+    PRINT           = auto()    # a
+    PRINTLN         = auto()    # a
+    SLEEP           = auto()    # a
+    CLRSCRN         = auto()
+    CHECK_DEFINED   = auto()    # slot, name
+    CALL_NATIVE     = auto()    # dst, Native, argument registers
+
+    # Control flow, handled by the dispatch loop itself. Targets are indices into
+    # the function's register code.
+    JUMP            = auto()    # target
+    JUMP_FALSE      = auto()    # condition, target
+    JUMP_TRUE       = auto()    # condition, target
+    COMPARE_JUMP    = auto()    # comparison function, a, b, target taken when false
+    CALL            = auto()    # dst, function, argument registers
+    TAIL_CALL       = auto()    # function, argument registers
+    RET             = auto()    # a
+    # Only in loops compiled by `loop_compiler.py`: hands control back to the
+    # stack VM at a code segment position, pushing the registers' values first.
+    EXIT            = auto()    # position, registers
+
+FIRST_CONTROL_OP = RegOp.JUMP
+
+BINARY_OPS = {
+    OpCode.ADD:    RegOp.ADD,
+    OpCode.SUB:    RegOp.SUB,
+    OpCode.MUL:    RegOp.MUL,
+    OpCode.DIV:    RegOp.DIV,
+    OpCode.MODULO: RegOp.MODULO,
+}
+
+CONSTANT_OPS = {OpCode.NUMBER, OpCode.STRING, OpCode.TRUE, OpCode.FALSE, OpCode.NULL}
+KEYWORD_VALUES = {OpCode.TRUE: True, OpCode.FALSE: False, OpCode.NULL: None}
+
+# Stack instructions that read a local slot, and which operands hold the slots.
+SLOT_READS = {
+    OpCode.LOAD_LOCAL:               (0,),
+    OpCode.LOAD_SUBSCRIPT:           (0,),
+    OpCode.STORE_SUBSCRIPT:          (0,),
+    OpCode.INC_LOCAL:                (0,),
+    OpCode.DEC_LOCAL:                (0,),
+    OpCode.COMPARE_LOCAL_CONST_JUMP: (0,),
+    OpCode.COMPARE_LOCALS_JUMP:      (0, 1),
+}
+NO_FALL_THROUGH = {OpCode.JUMP, OpCode.LOOP, OpCode.RET, OpCode.TAIL_CALL}
+
+
+class RegisterFunction:
+    """A FunctionDeclaration compiled to register code."""
+    def __init__(self, func_decl):
+        self.name = func_decl.name
+        self.param_count = len(func_decl.params)
+        self.local_names = func_decl.local_names
+        # Registers from `temp_base` on are temporaries; the ones between the locals
+        # and `temp_base` hold constants.
+        self.temp_base = 0
+        self.code = []
+        # For each instruction in `code`, the position in the stack code segment of
+        # the instruction it was compiled from.
+        self.ips = []
+        # Position in `code` of each position in the code segment.
+        self.pc_at_ip = {}
+        # (position in the code segment, stack depth) of each jump target in `code`.
+        self.targets = {}
+        # Initial registers of a frame: undefined locals, constants, temporaries.
+        self.template = []
+        # (start, end, name) ranges of `code` holding inlined calls.
+        self.inlined = []
+
+
+def definitely_defined(instructions: list, param_count: int):
+    """For each instruction, the local slots that hold a value whenever it runs:
+    the parameters, and every slot stored or successfully read on all paths to it.
+    None for unreachable instructions."""
+    position = {id(instruction): index for index, instruction in enumerate(instructions)}
+    defined = [None] * len(instructions)
+    defined[0] = frozenset(range(param_count))
+    pending = [0]
+    while pending:
+        index = pending.pop()
+        instruction = instructions[index]
+        after = set(defined[index])
+        if instruction.op == OpCode.STORE_LOCAL:
+            after.add(instruction.operands[0])
+        for operand in SLOT_READS.get(instruction.op, ()):
+            after.add(instruction.operands[operand])
+        successors = []
+        if instruction.target is not None:
+            successors.append(position[id(instruction.target)])
+        if instruction.op not in NO_FALL_THROUGH and index + 1 < len(instructions):
+            successors.append(index + 1)
+        for successor in successors:
+            merged = frozenset(after) if defined[successor] is None else defined[successor] & after
+            if merged != defined[successor]:
+                defined[successor] = merged
+                pending.append(successor)
+    return defined
+
+
+class _Compiler:
+    """Turns one function's stack code into register code by tracking, for each
+    operand stack entry, the register that holds its value. Loads of locals and
+    constants emit nothing; they just push the register they live in."""
+    def __init__(self, func_decl, functions: dict):
+        self.func_decl = func_decl
+        self.function = functions[func_decl.name]
+        self.functions = functions
+        self.code = []
+        self.ips = []
+        self.ip = 0
+        self.stack = []
+        self.constants = {}
+        # Register written by the last emitted instruction, if it's a temporary.
+        self.last_temp = None
+
+    def constant(self, value):
+        # The type is part of the key so `1`, `1.0` and `true` get their own registers.
+        return self.constants[(type(value), value)]
+
+    def collect_constants(self, instructions: list):
+        values = []
+        for instruction in instructions:
+            if instruction.op in (OpCode.NUMBER, OpCode.STRING):
+                values.append(instruction.operands[0])
+            elif instruction.op in KEYWORD_VALUES:
+                values.append(KEYWORD_VALUES[instruction.op])
+            elif instruction.op in (OpCode.INC_LOCAL, OpCode.DEC_LOCAL, OpCode.COMPARE_LOCAL_CONST_JUMP):
+                values.append(instruction.operands[1])
+        register = len(self.func_decl.local_names)
+        for value in values:
+            if (type(value), value) not in self.constants:
+                self.constants[(type(value), value)] = register
+                register += 1
+        self.temp_base = register
+        self.temp_count = 0
+
+    def temp(self, depth: int):
+        """The temporary holding the stack entry at `depth`."""
+        self.temp_count = max(self.temp_count, depth + 1)
+        return self.temp_base + depth
+
+    def push_temp(self):
+        register = self.temp(len(self.stack))
+        self.stack.append(register)
+        return register
+
+    def pop(self, count=None):
+        if count is None:
+            return self.stack.pop()
+        if count == 0:
+            return ()
+        operands = tuple(self.stack[-count:])
+        del self.stack[-count:]
+        return operands
+
+    def emit(self, *instruction):
+        self.code.append(instruction)
+        self.ips.append(self.ip)
+        self.last_temp = None
+
+    def emit_to_temp(self, op, *operands):
+        register = self.push_temp()
+        self.emit(op, register, *operands)
+        self.last_temp = register
+
+    def check_defined(self, slot: int, defined: frozenset):
+        if slot not in defined:
+            self.emit(RegOp.CHECK_DEFINED, slot, self.func_decl.local_names[slot])
+
+    def before_write(self, slot: int):
+        # Stack entries that still refer to the local about to change get their
+        # current value copied into their own temporary.
+        for depth, register in enumerate(self.stack):
+            if register == slot:
+                temp = self.temp(depth)
+                self.emit(RegOp.MOVE, temp, slot)
+                self.stack[depth] = temp
+
+    def materialize(self):
+        # Where paths join, each stack entry must be in the same register on every
+        # path: the temporary for its depth.
+        for depth, register in enumerate(self.stack):
+            temp = self.temp(depth)
+            if register != temp:
+                self.emit(RegOp.MOVE, temp, register)
+                self.stack[depth] = temp
+        self.last_temp = None
+
+    def store_local(self, slot: int):
+        value = self.pop()
+        self.before_write(slot)
+        if value == self.last_temp:
+            # `c = a + b`: the addition writes `c` directly.
+            last = self.code[-1]
+            self.code[-1] = (last[0], slot, *last[2:])
+        else:
+            self.emit(RegOp.MOVE, slot, value)
+        self.last_temp = None
+
+    def compile(self):
+        instructions = decode(self.func_decl.code_segment)
+        defined = definitely_defined(instructions, len(self.func_decl.params))
+        self.collect_constants(instructions)
+
+        targets = {id(instruction.target) for instruction in instructions
+                   if instruction.target is not None}
+        # Stack depth at each jump target, as left by the jumps to it. The parser
+        # only jumps with an empty stack, but inlined calls can jump mid-expression.
+        target_depth = {}
+        pc_at_ip = {}
+        jumps = []      # (index in code, operand index, target Instruction)
+        pc_of = {}
+        ip_of = {}
+        ip = 0
+        falls_through = True
+        for instruction, defined_slots in zip(instructions, defined):
+            if defined_slots is None:
+                # Unreachable, e.g. the `NULL RET` after a final `return` at -O0.
+                pc_at_ip[ip] = pc_of[id(instruction)] = len(self.code)
+                ip += instruction.size()
+                falls_through = False
+                continue
+            if id(instruction) in targets:
+                if falls_through:
+                    self.materialize()
+                else:
+                    depth = target_depth.get(id(instruction), 0)
+                    self.stack = [self.temp(index) for index in range(depth)]
+                    self.last_temp = None
+            pc_at_ip[ip] = len(self.code)
+            pc_of[id(instruction)] = len(self.code)
+            ip_of[id(instruction)] = self.ip = ip
+            ip += instruction.size()
+            jump = self.translate(instruction, defined_slots)
+            if jump is not None:
+                jumps.append((len(self.code) - 1, jump, instruction.target))
+                target_depth[id(instruction.target)] = len(self.stack)
+            falls_through = instruction.op not in NO_FALL_THROUGH
+        pc_at_ip[ip] = len(self.code)
+
+        function = self.function
+        for index, operand, target in jumps:
+            patched = list(self.code[index])
+            patched[operand] = pc_of[id(target)]
+            self.code[index] = tuple(patched)
+            function.targets[pc_of[id(target)]] = (ip_of[id(target)], target_depth[id(target)])
+
+        function.code = self.code
+        function.ips = self.ips
+        function.pc_at_ip = pc_at_ip
+        function.temp_base = self.temp_base
+        function.template = [UNDEFINED] * len(self.func_decl.local_names)
+        function.template.extend(value for _, value in self.constants)
+        function.template.extend([None] * self.temp_count)
+        function.inlined = [(pc_at_ip[start], pc_at_ip[end], name)
+                            for start, end, name in self.func_decl.inlined]
+        return function
+
+    def translate(self, instruction, defined: frozenset):
+        """Emits the register code for one stack instruction. For jumps, returns
+        the operand index of the target in the emitted instruction."""
+        # Code the stack VM has already run can hold its type-specialized instructions.
+        op = GENERIC_OPS.get(instruction.op, instruction.op)
+        operands = instruction.operands
+        if op in (OpCode.NUMBER, OpCode.STRING):
+            self.stack.append(self.constant(operands[0]))
+        elif op in KEYWORD_VALUES:
+            self.stack.append(self.constant(KEYWORD_VALUES[op]))
+        elif op == OpCode.LOAD_LOCAL:
+            self.check_defined(operands[0], defined)
+            self.stack.append(operands[0])
+        elif op == OpCode.STORE_LOCAL:
+            self.store_local(operands[0])
+        elif op in BINARY_OPS:
+            b, a = self.pop(), self.pop()
+            self.emit_to_temp(BINARY_OPS[op], a, b)
+        elif op in COMPARISONS:
+            b, a = self.pop(), self.pop()
+            self.emit_to_temp(RegOp.COMPARE, a, b, COMPARISONS[op])
+        elif op == OpCode.NEGATION:
+            self.emit_to_temp(RegOp.NEGATE, self.pop())
+        elif op == OpCode.NOT:
+            self.emit_to_temp(RegOp.NOT, self.pop())
+        elif op == OpCode.JUMP_FALSE:
+            condition = self.pop()
+            if condition == self.last_temp and self.code[-1][0] == RegOp.COMPARE:
+                # A comparison used only as a branch condition jumps directly.
+                _, _, a, b, comparison = self.code.pop()
+                self.ips.pop()
+                self.materialize()
+                self.emit(RegOp.COMPARE_JUMP, comparison, a, b, None)
+                return 4
+            self.materialize()
+            self.emit(RegOp.JUMP_FALSE, condition, None)
+            return 2
+        elif op == OpCode.JUMP_TRUE:
+            condition = self.pop()
+            self.materialize()
+            self.emit(RegOp.JUMP_TRUE, condition, None)
+            return 2
+        elif op in (OpCode.JUMP, OpCode.LOOP):
+            self.materialize()
+            self.emit(RegOp.JUMP, None)
+            return 1
+        elif op in (OpCode.COMPARE_LOCAL_CONST_JUMP, OpCode.COMPARE_LOCALS_JUMP):
+            slot, other, comparison, _ = operands
+            self.check_defined(slot, defined)
+            if op == OpCode.COMPARE_LOCALS_JUMP:
+                self.check_defined(other, defined)
+            else:
+                other = self.constant(other)
+            self.materialize()
+            self.emit(RegOp.COMPARE_JUMP, COMPARISONS[comparison], slot, other, None)
+            return 4
+        elif op in (OpCode.INC_LOCAL, OpCode.DEC_LOCAL):
+            slot, amount = operands
+            self.check_defined(slot, defined)
+            self.before_write(slot)
+            self.emit(RegOp.ADD if op == OpCode.INC_LOCAL else RegOp.SUB, slot, slot, self.constant(amount))
+        elif op == OpCode.PRINT:
+            self.emit(RegOp.PRINT, self.pop())
+        elif op == OpCode.PRINTLN:
+            self.emit(RegOp.PRINTLN, self.pop())
+        elif op == OpCode.SLEEP:
+            self.emit(RegOp.SLEEP, self.pop())
+        elif op == OpCode.CLRSCRN:
+            self.emit(RegOp.CLRSCRN)
+        elif op == OpCode.APPEND:
+            list_register, value = self.pop(), self.pop()
+            self.emit(RegOp.APPEND, list_register, value)
+        elif op == OpCode.LIST:
+            self.emit_to_temp(RegOp.LIST, self.pop(operands[0]))
+        elif op == OpCode.LIST_CONST:
+            self.emit_to_temp(RegOp.LIST_CONST, operands[0])
+        elif op == OpCode.LOAD_SUBSCRIPT:
+            slot, dimensions = operands
+            indices = self.pop(dimensions)
+            self.check_defined(slot, defined)
+            self.emit_to_temp(RegOp.LOAD_SUBSCRIPT, slot, indices, self.func_decl.local_names[slot])
+        elif op == OpCode.STORE_SUBSCRIPT:
+            slot, dimensions = operands
+            value = self.pop()
+            indices = self.pop(dimensions)
+            self.check_defined(slot, defined)
+            self.emit(RegOp.STORE_SUBSCRIPT, slot, indices, value, self.func_decl.local_names[slot])
+        elif op == OpCode.POP:
+            self.pop()
+        elif op == OpCode.RET:
+            self.emit(RegOp.RET, self.pop())
+        elif op == OpCode.CALL:
+            callee, arg_count = operands
+            args = self.pop(arg_count)
+            self.emit_to_temp(RegOp.CALL, self.functions[callee.name], args)
+        elif op == OpCode.TAIL_CALL:
+            callee, arg_count = operands
+            self.emit(RegOp.TAIL_CALL, self.functions[callee.name], self.pop(arg_count))
+        elif op == OpCode.CALL_NATIVE:
+            native, arg_count = operands
+            self.emit_to_temp(RegOp.CALL_NATIVE, native, self.pop(arg_count))
+        else:
+            raise ValueError(f"Can't compile `{op.name}` to register code.")
+        return None
+
+
+def compile_function(func_decl, functions: dict) -> RegisterFunction:
+    """Compiles one function declaration into its RegisterFunction in `functions`,
+    which must have one for every function it calls."""
+    return _Compiler(func_decl, functions).compile()
+
+def compile_functions(function_declarations: dict) -> dict:
+    """Compiles linked (and possibly optimized and inlined) function declarations
+    to register code."""
+    functions = {name: RegisterFunction(func_decl) for name, func_decl in function_declarations.items()}
+    for func_decl in function_declarations.values():
+        compile_function(func_decl, functions)
+    return functions
+
+
+def subscript(regs: list, slot: int, indices: tuple, name: str):
+    """Walks the index registers into the list in `slot`. Returns the innermost
+    list and the last index."""
+    list_obj = regs[slot]
+    last = len(indices) - 1
+    for position, register in enumerate(indices):
+        if not isinstance(list_obj, ListValue):
+            raise RuntimeError(f"Can't subscript expression " +
+                               f"of type `{type_name(list_obj)}`")
+        index = regs[register]
+        if type(index) is not int:
+            if type(index) is not float:
+                raise RuntimeError(f"Can't use exression of type `{type_name(index)}` " +
+                                   f"to subscript `{name}`.")
+            index = int(index)
+        items = list_obj.items
+        if index >= len(items) or index < 0:
+            raise RuntimeError(f"Index `{index}` out of bounds " +
+                               f"for list of length `{len(items)}`.")
+        if position != last:
+            list_obj = items[index]
+    return list_obj, index
+
+# Handlers take the frame's registers and the instruction.
+
+def move(regs, ins):
+    regs[ins[1]] = regs[ins[2]]
+
+def add_registers(regs, ins):
+    a = regs[ins[2]]
+    b = regs[ins[3]]
+    if type(a) is int and type(b) is int:
+        regs[ins[1]] = a + b
+    else:
+        regs[ins[1]] = add(a, b)
+
+def sub_registers(regs, ins):
+    a = regs[ins[2]]
+    b = regs[ins[3]]
+    if type(a) is int and type(b) is int:
+        regs[ins[1]] = a - b
+    else:
+        regs[ins[1]] = sub(a, b)
+
+def mul_registers(regs, ins):
+    a = regs[ins[2]]
+    b = regs[ins[3]]
+    if type(a) is int and type(b) is int:
+        regs[ins[1]] = a * b
+    else:
+        regs[ins[1]] = mul(a, b)
+
+def div_registers(regs, ins):
+    regs[ins[1]] = div(regs[ins[2]], regs[ins[3]])
+
+def mod_registers(regs, ins):
+    a = regs[ins[2]]
+    b = regs[ins[3]]
+    if type(a) is int and type(b) is int and b:
+        regs[ins[1]] = a % b
+    else:
+        regs[ins[1]] = mod(a, b)
+
+def compare_registers(regs, ins):
+    regs[ins[1]] = ins[4](regs[ins[2]], regs[ins[3]])
+
+def negate_register(regs, ins):
+    regs[ins[1]] = negate(regs[ins[2]])
+
+def not_register(regs, ins):
+    operand = regs[ins[2]]
+    if not isinstance(operand, bool):
+        raise RuntimeError(f"Can't logic negate instance of type `{type_name(operand)}`.")
+    regs[ins[1]] = not operand
+
+def list_registers(regs, ins):
+    regs[ins[1]] = ListValue([regs[register] for register in ins[2]])
+
+def list_const(regs, ins):
+    regs[ins[1]] = copy_template(ins[2])
+
+def load_subscript(regs, ins):
+    list_obj, index = subscript(regs, ins[2], ins[3], ins[4])
+    regs[ins[1]] = list_obj.items[index]
+
+def store_subscript(regs, ins):
+    list_obj, index = subscript(regs, ins[1], ins[2], ins[4])
+    list_obj.set(index, regs[ins[3]])
+
+def append(regs, ins):
+    list_obj = regs[ins[1]]
+    if not isinstance(list_obj, ListValue):
+        raise RuntimeError(f"Can't subscript expression " +
+                           f"of type `{type_name(list_obj)}`")
+    list_obj.append(regs[ins[2]])
+
+def check_defined(regs, ins):
+    if regs[ins[1]] is UNDEFINED:
+        raise RuntimeError(f"Undefined variable `{ins[2]}`.")
+
+
+class RegisterVM:
+    """Runs register code. Same language, same output and error messages as the
+    stack VM in `vm.py`; no profiler and no memoization."""
+    def __init__(self, func_decls: dict, output: OutputWriter=None, workers=None):
+        self.func_decls = func_decls
+        self.functions = compile_functions(func_decls)
+        self.output = output if output is not None else OutputWriter()
+        self.workers = workers
+        self.call_trace_stack = []
+        self.dispatch_table = self.build_dispatch_table()
+
+    def build_dispatch_table(self):
+        handlers = {
+            RegOp.MOVE:            move,
+            RegOp.ADD:             add_registers,
+            RegOp.SUB:             sub_registers,
+            RegOp.MUL:             mul_registers,
+            RegOp.DIV:             div_registers,
+            RegOp.MODULO:          mod_registers,
+            RegOp.COMPARE:         compare_registers,
+            RegOp.NEGATE:          negate_register,
+            RegOp.NOT:             not_register,
+            RegOp.LIST:            list_registers,
+            RegOp.LIST_CONST:      list_const,
+            RegOp.LOAD_SUBSCRIPT:  load_subscript,
+            RegOp.STORE_SUBSCRIPT: store_subscript,
+            RegOp.APPEND:          append,
+            RegOp.PRINT:           self.print,
+            RegOp.PRINTLN:         self.println,
+            RegOp.SLEEP:           self.sleep,
+            RegOp.CLRSCRN:         self.clrscrn,
+            RegOp.CHECK_DEFINED:   check_defined,
+            RegOp.CALL_NATIVE:     self.call_native,
+        }
+        table = [None] * FIRST_CONTROL_OP
+        for op, handler in handlers.items():
+            table[op] = handler
+        return table
+
+    def run(self):
+        try:
+            if 'main' not in self.functions:
+                raise RuntimeError("undefined function.")
+            self.run_function(self.functions['main'])
+        except RuntimeError as e:
+            self.output.write(f"Runtime error:  {e}\n")
+            self.print_stack_trace()
+        finally:
+            self.output.flush()
+
+    def print_stack_trace(self):
+        self.output.write("Stack trace:\n")
+        for frame in self.call_trace_stack:
+            self.output.write(f"\t <{frame}>\n")
+
+    def print(self, regs, ins):
+        self.output.write(display(regs[ins[1]]))
+
+    def println(self, regs, ins):
+        self.output.write(display(regs[ins[1]]) + "\n")
+
+    def clrscrn(self, regs, ins):
+        self.output.clear_screen()
+
+    def call_native(self, regs, ins):
+        regs[ins[1]] = ins[2].function(self, [regs[register] for register in ins[3]])
+
+    def sleep(self, regs, ins):
+        self.output.flush()
+        amount = regs[ins[1]]
+        if not is_number(amount):
+            raise RuntimeError(f"Sleep duration must by of type `number` not `{type_name(amount)}`.")
+        time.sleep(amount)
+
+    def trace(self, frames: list, function: RegisterFunction, pc: int):
+        """The call trace at a runtime error, including inlined functions."""
+        trace = []
+        for frame_function, frame_pc in [(frame[0], frame[2]) for frame in frames] + [(function, pc)]:
+            trace.append(frame_function.name)
+            trace.extend(name for start, end, name in frame_function.inlined if start <= frame_pc < end)
+        return trace
+
+    def run_function(self, function: RegisterFunction):
+        # Like the stack VM, calls don't recurse in Python: callers wait on `frames`
+        # as (function, registers, pc) until the callee returns.
+        frames = []
+        code = function.code
+        regs = function.template.copy()
+        pc = 0
+        dispatch_table = self.dispatch_table
+        first_control_op = FIRST_CONTROL_OP
+        JUMP, JUMP_FALSE, JUMP_TRUE = RegOp.JUMP, RegOp.JUMP_FALSE, RegOp.JUMP_TRUE
+        COMPARE_JUMP, CALL, TAIL_CALL = RegOp.COMPARE_JUMP, RegOp.CALL, RegOp.TAIL_CALL
+        try:
+            while True:
+                ins = code[pc]
+                op = ins[0]
+                if op < first_control_op:
+                    dispatch_table[op](regs, ins)
+                    pc += 1
+                elif op == COMPARE_JUMP:
+                    if ins[1](regs[ins[2]], regs[ins[3]]):
+                        pc += 1
+                    else:
+                        pc = ins[4]
+                elif op == JUMP:
+                    pc = ins[1]
+                elif op == JUMP_FALSE or op == JUMP_TRUE:
+                    condition = regs[ins[1]]
+                    if not isinstance(condition, bool):
+                        raise RuntimeError(f"Condition can't be of type `{type_name(condition)}`.")
+                    if condition == (op == JUMP_TRUE):
+                        pc = ins[2]
+                    else:
+                        pc += 1
+                elif op == CALL:
+                    callee = ins[2]
+                    callee_regs = callee.template.copy()
+                    for slot, register in enumerate(ins[3]):
+                        callee_regs[slot] = regs[register]
+                    frames.append((function, regs, pc))
+                    function, code, regs, pc = callee, callee.code, callee_regs, 0
+                elif op == TAIL_CALL:
+                    callee = ins[1]
+                    callee_regs = callee.template.copy()
+                    for slot, register in enumerate(ins[2]):
+                        callee_regs[slot] = regs[register]
+                    function, code, regs, pc = callee, callee.code, callee_regs, 0
+                else:
+                    ret_value = regs[ins[1]]
+                    if not frames:
+                        return ret_value
+                    function, regs, pc = frames.pop()
+                    code = function.code
+                    regs[code[pc][1]] = ret_value
+                    pc += 1
+        except RuntimeError:
+            self.call_trace_stack = self.trace(frames, function, pc)
+            raise
@@ -1,4 +1,6 @@
 from enum import Enum, auto
+from typing import Iterator
+import re
 import sys
 
 class TokenType(Enum):
@@ -45,6 +47,8 @@ class TokenType(Enum):
 
 
 class Token:
+    __slots__ = ('tok_type', 'lexeme', 'line', 'value')
+
     def __init__(self, tok_type: TokenType, lexeme: str, line: int, value=None):
         self.tok_type = tok_type
         self.lexeme = lexeme
@@ -79,160 +83,94 @@ class _Lexer:
         "clrscrn": TokenType.CLRSCRN,
     }
 
+    symbols = {
+        ',':  TokenType.COMMA,
+        '+':  TokenType.PLUS,
+        '-':  TokenType.MINUS,
+        '*':  TokenType.STAR,
+        '/':  TokenType.SLASH,
+        '(':  TokenType.LEFT_PAREN,
+        ')':  TokenType.RIGHT_PAREN,
+        '{':  TokenType.LEFT_BRACE,
+        '}':  TokenType.RIGHT_BRACE,
+        '%':  TokenType.PERCENT,
+        '[':  TokenType.LEFT_BRACKET,
+        ']':  TokenType.RIGHT_BRACKET,
+        '=':  TokenType.EQUAL,
+        '==': TokenType.EQUAL_EQUAL,
+        '>':  TokenType.GREATER,
+        '>=': TokenType.GREATER_EQUAL,
+        '<':  TokenType.LESS,
+        '<=': TokenType.LESS_EQUAL,
+    }
+
+    # One alternative per kind of lexeme, tried in order at each position. 
+    # Identifiers start with a letter and continue with letters or `_`.
+    pattern = re.compile(r'''
+          (?P<NEWLINE>      \n)
+        | (?P<WHITESPACE>   [ \t\r]+)
+        | (?P<NUMBER>       \d+(?:\.\d+)?)
+        | (?P<NAME>         [^\W\d_][^\W\d]*)
+        | (?P<STRING>       "[^"]*")
+        | (?P<SYMBOL>       [=<>]=? | [-,+*/(){}%\[\]])
+        | (?P<UNTERMINATED> ")
+        | (?P<UNEXPECTED>   .)
+    ''', re.VERBOSE)
+
     def __init__(self, source: str):
         self.source = source
-        self.index = 0
         self.tokens = []
-        self.error_msg = ''
         self.current_line = 1
     
-    def advance(self):
-        self.index += 1
-    
-    def current(self):
-        return self.source[self.index]
-    
-    def peek_next(self):
-        self.advance()
-        if self.at_end():
-            return '\0'
-        c = self.source[self.index]
-        self.index -= 1
-        return c
-    
-    def at_end(self):
-        return self.index >= len(self.source)
-
-    def consume_white_space(self):
-        def is_white_space():
-            c = self.current()
-            return c == ' ' or c == '\t'
-
-        while not self.at_end() and is_white_space():
-            self.advance()
-
-    def number(self):
-        num = ''
-        while not self.at_end() and self.current().isnumeric():
-            num += self.current()
-            self.advance()
-
-        self.index -= 1 
-        return self.new_token(TokenType.NUMBER, num, float(num))
-
-    def keyword_or_identifier(self):
-        def valid_var_letter():
-            return self.current().isalpha() or self.current() == '_'
-        iden = ''
-        while not self.at_end() and valid_var_letter():
-            iden += self.current()
-            self.advance()
+    def scan(self):
+        """Yields the tokens one at a time, ending with EOF."""
+        keywords = self.keywords
+        symbols = self.symbols
+        for match in self.pattern.finditer(self.source):
+            kind = match.lastgroup
+            lexeme = match.group()
+            if kind == 'WHITESPACE':
+                continue
+            elif kind == 'NAME':
+                yield Token(keywords.get(lexeme, TokenType.IDENTIFIER), lexeme, self.current_line)
+            elif kind == 'SYMBOL':
+                yield Token(symbols[lexeme], lexeme, self.current_line)
+            elif kind == 'NEWLINE':
+                yield Token(TokenType.NEWLINE, '\\n', self.current_line)
+                self.current_line += 1
+            elif kind == 'NUMBER':
+                # Whole numbers stay exact ints, decimal literals are floats.
+                literal = float(lexeme) if '.' in lexeme else int(lexeme)
+                yield Token(TokenType.NUMBER, lexeme, self.current_line, literal)
+            elif kind == 'STRING':
+                yield Token(TokenType.STRING, lexeme[1:-1], self.current_line)
+                self.current_line += lexeme.count('\n')
+            elif kind == 'UNTERMINATED':
+                print('Unterminated string.')
+                print("Line:", self.current_line)
+                sys.exit(0)
+            else:
+                print(f'Unexpected character `{lexeme}`.')
+                print("Line:", self.current_line)
+                sys.exit(0)
+        yield self.new_token(TokenType.EOF, '')
 
-        self.index -= 1     
-        if iden in self.keywords:
-            return self.new_token(self.keywords[iden], iden)
-        else:
-            return self.new_token(TokenType.IDENTIFIER, iden)
-    
     def tokenize(self):
-        token = self.scan_token()
-        while token != TokenType.EOF:
-            self.tokens.append(token)
-            token = self.scan_token()
-        self.tokens.append(self.new_token(TokenType.EOF, ''))
-
-    def string_literal(self):
-        self.advance()
-        literal = ''
-        while not self.at_end() and self.current() != '"':
-            literal += self.current()
-            self.advance()
-
-        if self.at_end():
-            print('Unterminated string.')
-            print("Line:", self.current_line)
-            sys.exit(0)
-
-        return self.new_token(TokenType.STRING, literal)
+        self.tokens.extend(self.scan())
     
     def new_token(self, tok_type, lexeme, value=None):
         return Token(tok_type, lexeme, self.current_line, value)
 
-    def scan_token(self):
-        if self.at_end():
-            return TokenType.EOF
-        token = None
-        c = self.current()
-        if c.isnumeric():
-            token = self.number()
-        elif c.isalpha():
-            token = self.keyword_or_identifier()
-        
-        match c:
-            case '\n':
-                token = self.new_token(TokenType.NEWLINE, '\\n')
-                self.current_line += 1
-            case ' ' | '\t':
-                self.consume_white_space()
-                return self.scan_token()
-            case ',':
-                token = self.new_token(TokenType.COMMA, ',')
-            case '"':
-                token = self.string_literal()
-            case '+':
-                token = self.new_token(TokenType.PLUS, '+')
-            case '-':
-                token = self.new_token(TokenType.MINUS, '-')
-            case '*':
-                token = self.new_token(TokenType.STAR, '*')
-            case '/':
-                token = self.new_token(TokenType.SLASH, '/')
-            case '(':
-                token = self.new_token(TokenType.LEFT_PAREN, '(')
-            case ')':
-                token = self.new_token(TokenType.RIGHT_PAREN, ')')
-            case '{':
-                token = self.new_token(TokenType.LEFT_BRACE, '{')
-            case '}':
-                token = self.new_token(TokenType.RIGHT_BRACE, '}')
-            case '%':
-                token = self.new_token(TokenType.PERCENT, '%')
-            case '[':
-                token = self.new_token(TokenType.LEFT_BRACKET, '[')
-            case ']':
-                token = self.new_token(TokenType.RIGHT_BRACKET, ']')
-            case '=':
-                if self.peek_next() == '=':
-                    self.advance()
-                    token = self.new_token(TokenType.EQUAL_EQUAL, '==')
-                else:
-                    token = self.new_token(TokenType.EQUAL, '=')
-            case '>':
-                if self.peek_next() == '=':
-                    self.advance()
-                    token = self.new_token(TokenType.GREATER_EQUAL, '>=')
-                else:
-                    token = self.new_token(TokenType.GREATER, '>')
-
-            case '<':
-                if self.peek_next() == '=':
-                    self.advance()
-                    token = self.new_token(TokenType.LESS_EQUAL, '<=')
-                else:
-                    token = self.new_token(TokenType.LESS, '<')
-
-        self.advance()
-        return token 
-
 
 def tokenize(s: str) -> list[TokenType]:
     lexer = _Lexer(s)
-    try:
-        lexer.tokenize()
-    except RuntimeError:
-        print(lexer.error_msg, file=sys.stderr)
-        sys.exit(0)
+    lexer.tokenize()
     
     # print(lexer.tokens)
 
-    return lexer.tokens
\ No newline at end of file
+    return lexer.tokens
+
+def tokenize_stream(s: str) -> Iterator[Token]:
+    """Like `tokenize`, but produces the tokens lazily so the parser can consume
+    them as they are scanned, without ever holding the whole token list."""
+    return _Lexer(s).scan()
@@ -0,0 +1,95 @@
+from array import array
+
+# Numbers are ints while they are whole and come from whole numbers; decimal
+# literals and division produce floats. Both are the language's one number type.
+NUMBER_TYPES = (int, float)
+
+# Typecodes of the arrays that hold all-int and all-float lists unboxed.
+TYPECODES = {int: 'q', float: 'd'}
+ARRAY_TYPES = {'q': int, 'd': float}
+
+def is_number(value):
+    # `bool` is a subclass of `int`, so this can't be an isinstance check.
+    return type(value) is int or type(value) is float
+
+
+class ListValue:
+    """A list in the language. Lists holding only ints, or only floats, keep them
+    unboxed in an `array('q')` or `array('d')`; the first other value stored
+    switches the list, in place, to a plain Python list so that every reference to
+    it sees the change."""
+    __slots__ = ('items',)
+
+    def __init__(self, items: list):
+        self.items = items
+        kind = type(items[0]) if items else int
+        if kind in TYPECODES and all(type(item) is kind for item in items):
+            try:
+                self.items = array(TYPECODES[kind], items)
+            except OverflowError:
+                # An int too big for 64 bits.
+                pass
+
+    @classmethod
+    def wrap(cls, items):
+        """A list holding `items` as they are: an array the constructor would have
+        made, or a plain Python list."""
+        value = cls.__new__(cls)
+        value.items = items
+        return value
+
+    def __len__(self):
+        return len(self.items)
+
+    def set(self, index: int, value):
+        items = self.items
+        if type(items) is array and ARRAY_TYPES[items.typecode] is not type(value):
+            self.items = items = items.tolist()
+        try:
+            items[index] = value
+        except OverflowError:
+            self.items = items = items.tolist()
+            items[index] = value
+
+    def append(self, value):
+        items = self.items
+        if type(items) is array and ARRAY_TYPES[items.typecode] is not type(value):
+            self.items = items = items.tolist()
+        try:
+            items.append(value)
+        except OverflowError:
+            self.items = items = items.tolist()
+            items.append(value)
+
+    def as_list(self):
+        items = self.items
+        return items.tolist() if type(items) is array else items
+
+    def __eq__(self, other):
+        return isinstance(other, ListValue) and self.as_list() == other.as_list()
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return display(self)
+
+
+def display(value) -> str:
+    """How `print` shows `value`. Ints print like the other numbers, e.g. `3.0`."""
+    if type(value) is int:
+        try:
+            return repr(float(value))
+        except OverflowError:
+            return 'inf' if value > 0 else '-inf'
+    if isinstance(value, ListValue):
+        return '[' + ', '.join(repr(item) if type(item) is str else display(item)
+                               for item in value.items) + ']'
+    return str(value)
+
+def type_name(value):
+    """The name of `value`'s type as the language reports it in error messages."""
+    if isinstance(value, ListValue):
+        return 'list'
+    if type(value) is int:
+        return 'float'
+    return type(value).__name__
@@ -1,203 +1,489 @@
 from instructions import OpCode
 from parsing import FunctionDeclaration
+from values import ListValue, display, is_number, type_name
+from output import OutputWriter
+from memo import Memoizer, MISS
+import math
+import operator
+import sys
 import time
 
-import os
+# Marks a local slot that has not been assigned yet.
+UNDEFINED = object()
 
 class Func_obj:
-    def __init__(self, code_segment: list, params: list):
-        self.code_segment = code_segment
-        self.params = params
-        self.ip = 0
-        self.locals = {}
+    def __init__(self, func_decl: FunctionDeclaration):
         self.operand_stack = []
+        self.bind(func_decl)
 
-    def reset(self):
-        self.__init__(self.code_segment, self.params)
+    def bind(self, func_decl: FunctionDeclaration):
+        """Points the frame at `func_decl` so a pooled frame can be reused for a new call."""
+        self.code_segment = func_decl.code_segment
+        self.params = func_decl.params
+        self.local_names = func_decl.local_names
+        self.inlined = func_decl.inlined
+        self.ip = 0
+        self.locals = [UNDEFINED] * len(func_decl.local_names)
+        # (cache, key) the return value is stored under, for memoized calls.
+        self.memo = None
 
     def inc_pointer(self, distance: int):
         self.ip += distance
     
-    def peek_code(self, distance):
-        self.inc_pointer(distance)
-        if self.at_end():
-            return None
-        instruction = self.current()
-        self.ip -= distance
-        return instruction
-    
     def current(self):
         return self.code_segment[self.ip]
 
     def at_end(self):
         return self.ip >= len(self.code_segment)
     
-    def set_args(self, args: list):
-        if len(args) != len(self.params):
-            raise RuntimeError(f"function expects `{len(self.params)}` # of params " +
-                               f"but got `{len(args)}`.")
-
-        for i in range(len(args)):
-            param = self.params[i]
-            arg = args[i]
-            self.locals[param] = arg
-    
-    def ret(self):
-        ret_value = self.operand_stack.pop()
-        self.reset()
-        return ret_value
-    
-    def binary_op(self, op):
-        b = self.operand_stack.pop()
-        a = self.operand_stack.pop()
-        match op:
-            case '+':
-                self.operand_stack.append(add(a, b))
-            case '-':
-                self.operand_stack.append(sub(a, b))
-            case '*':
-                self.operand_stack.append(mul(a, b))
-            case '/':
-                self.operand_stack.append(div(a, b))
-            case '%':
-                self.operand_stack.append(mod(a, b))
+    def set_args(self, operand_stack: list, count: int):
+        """Moves the top `count` values of `operand_stack` into the parameter slots.
+        The linker has already checked that `count` matches the parameters."""
+        if count:
+            first = len(operand_stack) - count
+            self.locals[:count] = operand_stack[first:]
+            del operand_stack[first:]
     
+    def quicken(self, a, b, int_op, float_op, str_op=None):
+        """Rewrites the running generic instruction into its version for the operand
+        types just seen. The specialized versions fall back to the generic one, and
+        so back here, once the types change."""
+        kind = type(a)
+        if kind is not type(b):
+            return
+        if kind is int:
+            self.code_segment[self.ip] = int_op
+        elif kind is float:
+            self.code_segment[self.ip] = float_op
+        elif kind is str and str_op is not None:
+            self.code_segment[self.ip] = str_op
+
     def add(self):
         b = self.operand_stack.pop()
         a = self.operand_stack.pop()
-        add(a, b)
+        self.operand_stack.append(add(a, b))
+        self.quicken(a, b, OpCode.ADD_INT, OpCode.ADD_FLOAT, OpCode.ADD_STR)
     
     def sub(self):
         b = self.operand_stack.pop()
         a = self.operand_stack.pop()
-        sub(a, b)
-    
-    def print(self):
-        match self.current():
-            case OpCode.PRINT:
-                print(self.operand_stack.pop(), end='')
-            
-            case OpCode.PRINTLN:
-                print(self.operand_stack.pop())
-    
-    def call(self):
-        iden = self.operand_stack.pop()
-        args = self.operand_stack.pop()
-        return (iden, args)
+        self.operand_stack.append(sub(a, b))
+        self.quicken(a, b, OpCode.SUB_INT, OpCode.SUB_FLOAT)
+
+    def mul(self):
+        b = self.operand_stack.pop()
+        a = self.operand_stack.pop()
+        self.operand_stack.append(mul(a, b))
+        self.quicken(a, b, OpCode.MUL_INT, OpCode.MUL_FLOAT)
+
+    def div(self):
+        b = self.operand_stack.pop()
+        a = self.operand_stack.pop()
+        self.operand_stack.append(div(a, b))
+        self.quicken(a, b, OpCode.DIV_INT, OpCode.DIV_FLOAT)
+
+    def mod(self):
+        b = self.operand_stack.pop()
+        a = self.operand_stack.pop()
+        self.operand_stack.append(mod(a, b))
+        self.quicken(a, b, OpCode.MODULO_INT, OpCode.MODULO_FLOAT)
+
+    # The specialized instructions check their operand types and, if they don't
+    # match, restore the generic instruction and run it instead.
+
+    def add_float(self):
+        stack = self.operand_stack
+        b = stack.pop()
+        a = stack[-1]
+        if type(a) is float and type(b) is float:
+            stack[-1] = a + b
+        else:
+            stack.append(b)
+            self.code_segment[self.ip] = OpCode.ADD
+            self.add()
+
+    def add_int(self):
+        stack = self.operand_stack
+        b = stack.pop()
+        a = stack[-1]
+        if type(a) is int and type(b) is int:
+            stack[-1] = a + b
+        else:
+            stack.append(b)
+            self.code_segment[self.ip] = OpCode.ADD
+            self.add()
+
+    def add_str(self):
+        stack = self.operand_stack
+        b = stack.pop()
+        a = stack[-1]
+        if type(a) is str and type(b) is str:
+            stack[-1] = a + b
+        else:
+            stack.append(b)
+            self.code_segment[self.ip] = OpCode.ADD
+            self.add()
+
+    def sub_float(self):
+        stack = self.operand_stack
+        b = stack.pop()
+        a = stack[-1]
+        if type(a) is float and type(b) is float:
+            stack[-1] = a - b
+        else:
+            stack.append(b)
+            self.code_segment[self.ip] = OpCode.SUB
+            self.sub()
+
+    def sub_int(self):
+        stack = self.operand_stack
+        b = stack.pop()
+        a = stack[-1]
+        if type(a) is int and type(b) is int:
+            stack[-1] = a - b
+        else:
+            stack.append(b)
+            self.code_segment[self.ip] = OpCode.SUB
+            self.sub()
+
+    def mul_float(self):
+        stack = self.operand_stack
+        b = stack.pop()
+        a = stack[-1]
+        if type(a) is float and type(b) is float:
+            stack[-1] = a * b
+        else:
+            stack.append(b)
+            self.code_segment[self.ip] = OpCode.MUL
+            self.mul()
+
+    def mul_int(self):
+        stack = self.operand_stack
+        b = stack.pop()
+        a = stack[-1]
+        if type(a) is int and type(b) is int:
+            stack[-1] = a * b
+        else:
+            stack.append(b)
+            self.code_segment[self.ip] = OpCode.MUL
+            self.mul()
+
+    def div_float(self):
+        stack = self.operand_stack
+        b = stack.pop()
+        a = stack[-1]
+        # Division by zero is reported by the generic version.
+        if type(a) is float and type(b) is float and b:
+            stack[-1] = a / b
+        else:
+            stack.append(b)
+            self.code_segment[self.ip] = OpCode.DIV
+            self.div()
+
+    def div_int(self):
+        stack = self.operand_stack
+        b = stack.pop()
+        a = stack[-1]
+        # Division by zero is reported by the generic version.
+        if type(a) is int and type(b) is int and b:
+            try:
+                stack[-1] = a / b
+            except OverflowError:
+                # A quotient too big for a float.
+                stack[-1] = div(a, b)
+        else:
+            stack.append(b)
+            self.code_segment[self.ip] = OpCode.DIV
+            self.div()
+
+    def mod_float(self):
+        stack = self.operand_stack
+        b = stack.pop()
+        a = stack[-1]
+        # Division by zero is reported by the generic version.
+        if type(a) is float and type(b) is float and b:
+            stack[-1] = a % b
+        else:
+            stack.append(b)
+            self.code_segment[self.ip] = OpCode.MODULO
+            self.mod()
+
+    def mod_int(self):
+        stack = self.operand_stack
+        b = stack.pop()
+        a = stack[-1]
+        # Division by zero is reported by the generic version.
+        if type(a) is int and type(b) is int and b:
+            stack[-1] = a % b
+        else:
+            stack.append(b)
+            self.code_segment[self.ip] = OpCode.MODULO
+            self.mod()
 
     def push_next(self):
-        self.inc_pointer(1)
-        self.operand_stack.append(self.current())
-
-    def subscript(self, iden):
-        indeces = []
-        while self.peek_code(1) == OpCode.SUBSCRIPT:
-            index = self.operand_stack.pop() 
-            if not isinstance(index, float):
-                raise RuntimeError(f"Can't use exression of type `{type(index).__name__}` " +
-                                   f"to subscript `{iden}`.")
-            index = int(index)
-            indeces.insert(0, index) 
-            self.inc_pointer(1)
-        
-        list_obj = self.locals[iden]
-        if not isinstance(list_obj, list):
-            raise RuntimeError(f"Can't subscript expression " +
-                               f"of type `{type(list_obj).__name__}`")
+        self.ip += 1
+        self.operand_stack.append(self.code_segment[self.ip])
 
-        for index in indeces[:-1]:
-            if index >= len(list_obj) or index < 0:
-                raise RuntimeError(f"Index `{index}` out of bounds " + 
-                                   f"for list of length `{len(list_obj)}`.")
-            list_obj = list_obj[index]
-            if not isinstance(list_obj, list):
+    def subscript(self, slot, dimensions):
+        """Pops `dimensions` indices off the operand stack and walks them into the list
+        held in `slot`. Returns the innermost list and the last index."""
+        list_obj = self.get_local(slot)
+        stack = self.operand_stack
+        first = len(stack) - dimensions
+        last = len(stack) - 1
+        for position in range(first, last + 1):
+            if not isinstance(list_obj, ListValue):
                 raise RuntimeError(f"Can't subscript expression " +
-                                   f"of type `{type(list_obj).__name__}`")
-        index = indeces[-1]        
-        if index >= len(list_obj) or index < 0:
-            raise RuntimeError(f"Index `{index}` out of bounds " + 
-                                f"for list of length `{len(list_obj)}`.")
+                                   f"of type `{type_name(list_obj)}`")
+            index = stack[position]
+            if type(index) is not int:
+                if type(index) is not float:
+                    raise RuntimeError(f"Can't use exression of type `{type_name(index)}` " +
+                                       f"to subscript `{self.local_names[slot]}`.")
+                index = int(index)
+            items = list_obj.items
+            if index >= len(items) or index < 0:
+                raise RuntimeError(f"Index `{index}` out of bounds " + 
+                                   f"for list of length `{len(items)}`.")
+            if position != last:
+                list_obj = items[index]
+        del stack[first:]
         return list_obj, index
 
-    def resolve(self):
-        iden = self.operand_stack.pop()
-        if iden not in self.locals:
-            raise RuntimeError(f"Undefined variable `{iden}`.")
-        else:
-            if self.peek_code(1) == OpCode.SUBSCRIPT:
-                list_obj, index = self.subscript(iden)
-                self.operand_stack.append(list_obj[index])
-            else:
-                self.operand_stack.append(self.locals[iden])
+    def get_local(self, slot):
+        value = self.locals[slot]
+        if value is UNDEFINED:
+            raise RuntimeError(f"Undefined variable `{self.local_names[slot]}`.")
+        return value
+
+    def load_local(self):
+        self.ip += 1
+        self.operand_stack.append(self.get_local(self.code_segment[self.ip]))
     
-    def assignment(self):
-        iden = self.operand_stack.pop()
-        if self.peek_code(1) == OpCode.SUBSCRIPT:
-            value = self.operand_stack.pop()
-            list_obj, index = self.subscript(iden)
-            list_obj[index] = value
+    def store_local(self):
+        self.ip += 1
+        self.locals[self.code_segment[self.ip]] = self.operand_stack.pop()
+
+    def load_subscript(self):
+        slot = self.code_segment[self.ip + 1]
+        dimensions = self.code_segment[self.ip + 2]
+        self.ip += 2
+        list_obj, index = self.subscript(slot, dimensions)
+        self.operand_stack.append(list_obj.items[index])
+
+    def store_subscript(self):
+        slot = self.code_segment[self.ip + 1]
+        dimensions = self.code_segment[self.ip + 2]
+        self.ip += 2
+        value = self.operand_stack.pop()
+        list_obj, index = self.subscript(slot, dimensions)
+        list_obj.set(index, value)
+
+    def inc_local(self):
+        slot = self.code_segment[self.ip + 1]
+        amount = self.code_segment[self.ip + 2]
+        self.ip += 2
+        value = self.get_local(slot)
+        if type(value) is int and type(amount) is int:
+            self.locals[slot] = value + amount
         else:
-            value = self.operand_stack.pop()
-            self.locals[iden] = value
+            self.locals[slot] = add(value, amount)
+
+    def dec_local(self):
+        slot = self.code_segment[self.ip + 1]
+        amount = self.code_segment[self.ip + 2]
+        self.ip += 2
+        value = self.get_local(slot)
+        if type(value) is int and type(amount) is int:
+            self.locals[slot] = value - amount
+        else:
+            self.locals[slot] = sub(value, amount)
+
+    def compare_local_const_jump(self):
+        code_segment = self.code_segment
+        ip = self.ip
+        a = self.get_local(code_segment[ip + 1])
+        if COMPARISONS[code_segment[ip + 3]](a, code_segment[ip + 2]):
+            self.ip = ip + 4
+        else:
+            self.ip = ip + 4 + code_segment[ip + 4]
+
+    def compare_locals_jump(self):
+        code_segment = self.code_segment
+        ip = self.ip
+        a = self.get_local(code_segment[ip + 1])
+        b = self.get_local(code_segment[ip + 2])
+        if COMPARISONS[code_segment[ip + 3]](a, b):
+            self.ip = ip + 4
+        else:
+            self.ip = ip + 4 + code_segment[ip + 4]
 
     def list(self):
         self.inc_pointer(1)
         list_items_count = self.current()
         list_object = [self.operand_stack.pop() for i in range(list_items_count)]
         list_object.reverse()
-        self.operand_stack.append(list_object)
+        self.operand_stack.append(ListValue(list_object))
     
+    def list_const(self):
+        self.ip += 1
+        self.operand_stack.append(copy_template(self.code_segment[self.ip]))
+
+    def pop(self):
+        self.operand_stack.pop()
+
     def negate(self):
         self.operand_stack.append(negate(self.operand_stack.pop()))
 
     def Not(self):
         operand = self.operand_stack.pop()
         if not isinstance(operand, bool):
-            raise RuntimeError(f"Can't logic negate instance of type `{type(operand).__name__}`.")
+            raise RuntimeError(f"Can't logic negate instance of type `{type_name(operand)}`.")
         else:
             self.operand_stack.append(not operand)
     
-    def keyword_value(self):
-        keyword = self.current()
-        value = None
-        match keyword:
-            case OpCode.FALSE:
-                value = False
-            case OpCode.TRUE:
-                value = True
-            case OpCode.NULL:
-                value = None
-        self.operand_stack.append(value)
+    def true(self):
+        self.operand_stack.append(True)
+
+    def false(self):
+        self.operand_stack.append(False)
+
+    def null(self):
+        self.operand_stack.append(None)
     
     def equal_equal(self):
         self.operand_stack.append(self.operand_stack.pop() == self.operand_stack.pop())
     
-    def comparision(self):
-        keyword = self.current()
-        value = None
+    def greater(self):
+        b = self.operand_stack.pop()
+        a = self.operand_stack.pop()
+        self.operand_stack.append(comparision(a, b, ">"))
+        self.quicken(a, b, OpCode.GREATER_INT, OpCode.GREATER_FLOAT)
+
+    def greater_equal(self):
         b = self.operand_stack.pop()
         a = self.operand_stack.pop()
-        match keyword:
-            case OpCode.GREATER:
-                value = comparision(a, b, ">")
-            case OpCode.GREATER_EQUAL:
-                value = comparision(a, b, ">=")
-            case OpCode.LESS:
-                value = comparision(a, b, "<")
-            case OpCode.LESS_EQUAL:
-                value = comparision(a, b, "<=")
-        
-        self.operand_stack.append(value)
+        self.operand_stack.append(comparision(a, b, ">="))
+        self.quicken(a, b, OpCode.GREATER_EQUAL_INT, OpCode.GREATER_EQUAL_FLOAT)
+
+    def less(self):
+        b = self.operand_stack.pop()
+        a = self.operand_stack.pop()
+        self.operand_stack.append(comparision(a, b, "<"))
+        self.quicken(a, b, OpCode.LESS_INT, OpCode.LESS_FLOAT)
+
+    def less_equal(self):
+        b = self.operand_stack.pop()
+        a = self.operand_stack.pop()
+        self.operand_stack.append(comparision(a, b, "<="))
+        self.quicken(a, b, OpCode.LESS_EQUAL_INT, OpCode.LESS_EQUAL_FLOAT)
+
+    def greater_float(self):
+        stack = self.operand_stack
+        b = stack.pop()
+        a = stack[-1]
+        if type(a) is float and type(b) is float:
+            stack[-1] = a > b
+        else:
+            stack.append(b)
+            self.code_segment[self.ip] = OpCode.GREATER
+            self.greater()
+
+    def greater_int(self):
+        stack = self.operand_stack
+        b = stack.pop()
+        a = stack[-1]
+        if type(a) is int and type(b) is int:
+            stack[-1] = a > b
+        else:
+            stack.append(b)
+            self.code_segment[self.ip] = OpCode.GREATER
+            self.greater()
+
+    def greater_equal_float(self):
+        stack = self.operand_stack
+        b = stack.pop()
+        a = stack[-1]
+        if type(a) is float and type(b) is float:
+            stack[-1] = a >= b
+        else:
+            stack.append(b)
+            self.code_segment[self.ip] = OpCode.GREATER_EQUAL
+            self.greater_equal()
+
+    def greater_equal_int(self):
+        stack = self.operand_stack
+        b = stack.pop()
+        a = stack[-1]
+        if type(a) is int and type(b) is int:
+            stack[-1] = a >= b
+        else:
+            stack.append(b)
+            self.code_segment[self.ip] = OpCode.GREATER_EQUAL
+            self.greater_equal()
+
+    def less_float(self):
+        stack = self.operand_stack
+        b = stack.pop()
+        a = stack[-1]
+        if type(a) is float and type(b) is float:
+            stack[-1] = a < b
+        else:
+            stack.append(b)
+            self.code_segment[self.ip] = OpCode.LESS
+            self.less()
+
+    def less_int(self):
+        stack = self.operand_stack
+        b = stack.pop()
+        a = stack[-1]
+        if type(a) is int and type(b) is int:
+            stack[-1] = a < b
+        else:
+            stack.append(b)
+            self.code_segment[self.ip] = OpCode.LESS
+            self.less()
+
+    def less_equal_float(self):
+        stack = self.operand_stack
+        b = stack.pop()
+        a = stack[-1]
+        if type(a) is float and type(b) is float:
+            stack[-1] = a <= b
+        else:
+            stack.append(b)
+            self.code_segment[self.ip] = OpCode.LESS_EQUAL
+            self.less_equal()
+
+    def less_equal_int(self):
+        stack = self.operand_stack
+        b = stack.pop()
+        a = stack[-1]
+        if type(a) is int and type(b) is int:
+            stack[-1] = a <= b
+        else:
+            stack.append(b)
+            self.code_segment[self.ip] = OpCode.LESS_EQUAL
+            self.less_equal()
 
     def jump_false(self):
         condition = self.operand_stack.pop()
         if not isinstance(condition, bool):
-            raise RuntimeError(f"Condition can't be of type `{type(condition).__name__}`.")
+            raise RuntimeError(f"Condition can't be of type `{type_name(condition)}`.")
         if condition == True:
             self.inc_pointer(1)
         else:
             self.ip += self.code_segment[self.ip + 1] + 1
     
+    def jump_true(self):
+        condition = self.operand_stack.pop()
+        if not isinstance(condition, bool):
+            raise RuntimeError(f"Condition can't be of type `{type_name(condition)}`.")
+        if condition == False:
+            self.inc_pointer(1)
+        else:
+            self.ip += self.code_segment[self.ip + 1] + 1
+
     def jump(self):
         self.ip += self.code_segment[self.ip + 1] + 1
 
@@ -206,107 +492,416 @@ class Func_obj:
     
     def sleep(self):
         amount = self.operand_stack.pop()
-        if not isinstance(amount, float):
-            raise RuntimeError(f"Sleep duration must by of type `number` not `{type(amount).__name__}`.")
+        if not is_number(amount):
+            raise RuntimeError(f"Sleep duration must by of type `number` not `{type_name(amount)}`.")
         time.sleep(amount)
     
     def append(self):
-        iden = self.operand_stack.pop()
+        list_obj = self.operand_stack.pop()
         value = self.operand_stack.pop()
-        if iden not in self.locals:
-            raise RuntimeError(f"Undefined variable `{iden}`.")
-        list_obj = self.locals[iden]
-        if not isinstance(list_obj, list):
+        if not isinstance(list_obj, ListValue):
             raise RuntimeError(f"Can't subscript expression " +
-                               f"of type `{type(list_obj).__name__}`")
+                               f"of type `{type_name(list_obj)}`")
         list_obj.append(value)
 
 
 class VM:
-    def __init__(self, func_decls: {}):
+    def __init__(self, func_decls: {}, profiler=None, output: OutputWriter=None,
+                 memoizer: Memoizer=None, loop_compiler=None, workers=None):
         self.func_decls = func_decls
+        self.profiler = profiler
+        self.output = output if output is not None else OutputWriter()
+        self.memoizer = memoizer
+        self.memo_caches = memoizer.caches if memoizer is not None else {}
+        # Compiles hot loops; the profiler counts every opcode, so it runs without.
+        self.loop_compiler = loop_compiler if profiler is None else None
+        if self.loop_compiler is not None:
+            self.loop_compiler.vm = self
+        # Runs `spawn` and `pmap`; made by `parallel.workers_of` if not given.
+        self.workers = workers
         self.call_trace_stack = []
+        self.free_frames = []
+        self.dispatch_table = self.build_dispatch_table()
+
+    def build_dispatch_table(self):
+        # Handlers take the current Func_obj. CALL, TAIL_CALL and RET are absent on
+        # purpose: they switch frames, so the dispatch loop handles them itself.
+        handlers = {
+            OpCode.ADD:           Func_obj.add,
+            OpCode.SUB:           Func_obj.sub,
+            OpCode.MUL:           Func_obj.mul,
+            OpCode.DIV:           Func_obj.div,
+            OpCode.MODULO:        Func_obj.mod,
+            OpCode.NUMBER:        Func_obj.push_next,
+            OpCode.STRING:        Func_obj.push_next,
+            OpCode.TRUE:          Func_obj.true,
+            OpCode.FALSE:         Func_obj.false,
+            OpCode.NULL:          Func_obj.null,
+            OpCode.NEGATION:      Func_obj.negate,
+            OpCode.NOT:           Func_obj.Not,
+            OpCode.EQUAL_EQUAL:   Func_obj.equal_equal,
+            OpCode.GREATER:       Func_obj.greater,
+            OpCode.GREATER_EQUAL: Func_obj.greater_equal,
+            OpCode.LESS:          Func_obj.less,
+            OpCode.LESS_EQUAL:    Func_obj.less_equal,
+            OpCode.JUMP_FALSE:    Func_obj.jump_false,
+            OpCode.JUMP_TRUE:     Func_obj.jump_true,
+            OpCode.JUMP:          Func_obj.jump,
+            OpCode.LOOP:          Func_obj.loop,
+            OpCode.PRINT:         self.print,
+            OpCode.PRINTLN:       self.println,
+            OpCode.LOAD_LOCAL:    Func_obj.load_local,
+            OpCode.STORE_LOCAL:   Func_obj.store_local,
+            OpCode.LOAD_SUBSCRIPT:  Func_obj.load_subscript,
+            OpCode.STORE_SUBSCRIPT: Func_obj.store_subscript,
+            OpCode.LIST:          Func_obj.list,
+            OpCode.LIST_CONST:    Func_obj.list_const,
+            OpCode.POP:           Func_obj.pop,
+            OpCode.SLEEP:         self.sleep,
+            OpCode.CALL_NATIVE:   self.call_native,
+            OpCode.APPEND:        Func_obj.append,
+            OpCode.CLRSCRN:       self.clrscrn,
+
+            OpCode.INC_LOCAL:                Func_obj.inc_local,
+            OpCode.DEC_LOCAL:                Func_obj.dec_local,
+            OpCode.COMPARE_LOCAL_CONST_JUMP: Func_obj.compare_local_const_jump,
+            OpCode.COMPARE_LOCALS_JUMP:      Func_obj.compare_locals_jump,
+
+            OpCode.ADD_INT:             Func_obj.add_int,
+            OpCode.SUB_INT:             Func_obj.sub_int,
+            OpCode.MUL_INT:             Func_obj.mul_int,
+            OpCode.DIV_INT:             Func_obj.div_int,
+            OpCode.MODULO_INT:          Func_obj.mod_int,
+            OpCode.GREATER_INT:         Func_obj.greater_int,
+            OpCode.GREATER_EQUAL_INT:   Func_obj.greater_equal_int,
+            OpCode.LESS_INT:            Func_obj.less_int,
+            OpCode.LESS_EQUAL_INT:      Func_obj.less_equal_int,
+            OpCode.ADD_FLOAT:           Func_obj.add_float,
+            OpCode.ADD_STR:             Func_obj.add_str,
+            OpCode.SUB_FLOAT:           Func_obj.sub_float,
+            OpCode.MUL_FLOAT:           Func_obj.mul_float,
+            OpCode.DIV_FLOAT:           Func_obj.div_float,
+            OpCode.MODULO_FLOAT:        Func_obj.mod_float,
+            OpCode.GREATER_FLOAT:       Func_obj.greater_float,
+            OpCode.GREATER_EQUAL_FLOAT: Func_obj.greater_equal_float,
+            OpCode.LESS_FLOAT:          Func_obj.less_float,
+            OpCode.LESS_EQUAL_FLOAT:    Func_obj.less_equal_float,
+        }
+        if self.loop_compiler is not None:
+            handlers[OpCode.LOOP] = self.loop
+        table = [None] * (max(OpCode) + 1)
+        for op, handler in handlers.items():
+            table[op] = handler
+        return table
     
     def run(self):
+        # Compiled loops run their calls in a nested dispatch loop, so deep recursion
+        # through them needs a higher Python recursion limit.
+        recursion_limit = sys.getrecursionlimit()
+        if self.loop_compiler is not None:
+            sys.setrecursionlimit(max(recursion_limit, 1_000_000))
         try:
-            self.run_stack_frame('main', [])
+            if self.profiler is None:
+                self.run_stack_frame('main')
+            else:
+                self.run_stack_frame_profiled('main')
         except RuntimeError as e:
-            print("Runtime error: ", e)
+            self.output.write(f"Runtime error:  {e}\n")
             self.print_stack_trace()
+        finally:
+            sys.setrecursionlimit(recursion_limit)
+            self.output.flush()
+            if self.profiler is not None:
+                self.profiler.finish()
     
     def print_stack_trace(self):
-        print("Stack trace:")
+        self.output.write("Stack trace:\n")
         for frame in self.call_trace_stack:
-            print(f"\t <{frame}>")
+            self.output.write(f"\t <{frame}>\n")
+
+    def print(self, func_obj: Func_obj):
+        self.output.write(display(func_obj.operand_stack.pop()))
+
+    def println(self, func_obj: Func_obj):
+        self.output.write(display(func_obj.operand_stack.pop()) + "\n")
 
-    def run_stack_frame(self, func_name: str, func_args: list):
+    def clrscrn(self, func_obj: Func_obj):
+        self.output.clear_screen()
+
+    def sleep(self, func_obj: Func_obj):
+        self.output.flush()
+        func_obj.sleep()
+
+    def call_native(self, func_obj: Func_obj):
+        ip = func_obj.ip
+        native = func_obj.code_segment[ip + 1]
+        arg_count = func_obj.code_segment[ip + 2]
+        operand_stack = func_obj.operand_stack
+        first = len(operand_stack) - arg_count
+        args = operand_stack[first:]
+        del operand_stack[first:]
+        func_obj.ip = ip + 2
+        operand_stack.append(native.function(self, args))
+
+    def loop(self, func_obj: Func_obj):
+        exit_ip = self.loop_compiler.back_edge(func_obj)
+        if exit_ip is None:
+            func_obj.loop()
+        else:
+            # The dispatch loop's `ip += 1` lands on `exit_ip`.
+            func_obj.ip = exit_ip - 1
+
+    def push_frame(self, func_decl: FunctionDeclaration, operand_stack: list, arg_count: int):
+        if self.free_frames:
+            func_obj = self.free_frames.pop()
+            func_obj.bind(func_decl)
+        else:
+            func_obj = Func_obj(func_decl)
+        func_obj.set_args(operand_stack, arg_count)
+
+        self.call_trace_stack.append(func_decl.name)
+        return func_obj
+
+    def tail_call(self, func_obj: Func_obj, func_decl: FunctionDeclaration, arg_count: int):
+        """Rebinds the running frame to `func_decl` instead of pushing a new one, for
+        a call whose result the caller returns as is."""
+        operand_stack = func_obj.operand_stack
+        del operand_stack[:len(operand_stack) - arg_count]
+        # The caller's memoized result, if any, is still the callee's return value.
+        memo = func_obj.memo
+        func_obj.bind(func_decl)
+        func_obj.memo = memo
+        func_obj.set_args(operand_stack, arg_count)
+        self.call_trace_stack[-1] = func_decl.name
+
+    def main_declaration(self, func_name: str):
         if func_name not in self.func_decls:
             raise RuntimeError("undefined function.")
+        return self.func_decls[func_name]
+
+    def pop_frame(self, func_obj: Func_obj):
+        ret_value = func_obj.operand_stack.pop()
+        func_obj.operand_stack.clear()
+        self.free_frames.append(func_obj)
+        self.call_trace_stack.pop()
+        return ret_value
+
+    def add_inlined_frames(self, frames: list, func_obj: Func_obj, base: int=0):
+        """Puts the functions inlined where each frame stopped into the call trace,
+        as if they had been called. `frames` start at `base` in the call trace."""
+        stop = base + len(frames) + 1
+        trace = self.call_trace_stack[:base]
+        for name, frame in zip(self.call_trace_stack[base:stop], frames + [func_obj]):
+            trace.append(name)
+            trace.extend(inlined_name for start, end, inlined_name in frame.inlined
+                         if start <= frame.ip < end)
+        trace.extend(self.call_trace_stack[stop:])
+        self.call_trace_stack = trace
+
+    def memo_lookup(self, cache, operand_stack: list, arg_count: int):
+        """Returns the cache key for a call to a memoized function, or None if the
+        arguments can't be cached, and the cached result or MISS. On a hit the
+        arguments are popped."""
+        first = len(operand_stack) - arg_count
+        key = Memoizer.key(operand_stack[first:])
+        if key is None:
+            return None, MISS
+        ret_value = cache.lookup(key)
+        if ret_value is not MISS:
+            del operand_stack[first:]
+        return key, ret_value
+
+    def call(self, func_decl: FunctionDeclaration, args: list):
+        """Runs a call made by a compiled loop and returns its value."""
+        cache = self.memo_caches.get(func_decl.name)
+        key = None
+        if cache is not None:
+            key, ret_value = self.memo_lookup(cache, args, len(args))
+            if ret_value is not MISS:
+                return ret_value
+        func_obj = self.push_frame(func_decl, args, len(args))
+        if key is not None:
+            func_obj.memo = (cache, key)
+        return self.run_frame(func_obj)
+
+    def run_stack_frame(self, func_name: str):
+        return self.run_frame(self.push_frame(self.main_declaration(func_name), [], 0))
+
+    def run_frame(self, func_obj: Func_obj):
+        # Calls don't recurse in Python: the callers of the running frame are
+        # kept on `frames`, so script recursion depth is bounded only by memory.
+        frames = []
+        # Where this loop's frames start in the call trace; below them are the
+        # frames of compiled loops that called into it.
+        base = len(self.call_trace_stack) - 1
+
+        dispatch_table = self.dispatch_table
+        memo_caches = self.memo_caches
+        code_segment = func_obj.code_segment
+        call = OpCode.CALL
+        tail_call = OpCode.TAIL_CALL
+        ret = OpCode.RET
+        try:
+            while True:
+                op = code_segment[func_obj.ip]
+                if op == call:
+                    ip = func_obj.ip
+                    callee = code_segment[ip + 1]
+                    arg_count = code_segment[ip + 2]
+                    # RET's `ip += 1` then resumes the caller after the call's operands.
+                    func_obj.ip = ip + 2
+                    cache = memo_caches.get(callee.name)
+                    key = None
+                    if cache is not None:
+                        key, ret_value = self.memo_lookup(cache, func_obj.operand_stack, arg_count)
+                        if ret_value is not MISS:
+                            func_obj.operand_stack.append(ret_value)
+                            func_obj.ip += 1
+                            continue
+                    frames.append(func_obj)
+                    func_obj = self.push_frame(callee, func_obj.operand_stack, arg_count)
+                    if key is not None:
+                        func_obj.memo = (cache, key)
+                    code_segment = func_obj.code_segment
+                    continue
+                if op == tail_call:
+                    ip = func_obj.ip
+                    callee = code_segment[ip + 1]
+                    arg_count = code_segment[ip + 2]
+                    cache = memo_caches.get(callee.name)
+                    key = None
+                    ret_value = MISS
+                    if cache is not None:
+                        key, ret_value = self.memo_lookup(cache, func_obj.operand_stack, arg_count)
+                    if ret_value is MISS:
+                        self.tail_call(func_obj, callee, arg_count)
+                        if func_obj.memo is None and key is not None:
+                            func_obj.memo = (cache, key)
+                        code_segment = func_obj.code_segment
+                        continue
+                    # A cached result is returned straight away.
+                    func_obj.operand_stack.append(ret_value)
+                    op = ret
+                if op == ret:
+                    ret_value = self.pop_frame(func_obj)
+                    if func_obj.memo is not None:
+                        cache, key = func_obj.memo
+                        cache.store(key, ret_value)
+                    if not frames:
+                        return ret_value
+                    func_obj = frames.pop()
+                    code_segment = func_obj.code_segment
+                    func_obj.operand_stack.append(ret_value)
+                else:
+                    dispatch_table[op](func_obj)
+                func_obj.ip += 1
+        except RuntimeError:
+            self.add_inlined_frames(frames, func_obj, base)
+            raise
 
-        func_decl = self.func_decls[func_name]
-        func_obj = Func_obj(func_decl.code_segment, func_decl.params)
-        func_obj.set_args(func_args)
-
-        self.call_trace_stack.append(func_name)
-
-        while not func_obj.at_end():
-            op = func_obj.current()
-            match op:
-                case OpCode.ADD:
-                    func_obj.binary_op('+')
-                case OpCode.SUB:
-                    func_obj.binary_op('-')
-                case OpCode.MUL:
-                    func_obj.binary_op('*')
-                case OpCode.DIV:
-                    func_obj.binary_op('/')
-                case OpCode.MODULO:
-                    func_obj.binary_op('%')
-                case OpCode.EQUAL_EQUAL:
-                    func_obj.equal_equal()
-                case OpCode.GREATER | OpCode.GREATER_EQUAL | OpCode.LESS | OpCode.LESS_EQUAL:
-                    func_obj.comparision()
-                case OpCode.TRUE | OpCode.FALSE | OpCode.NULL:
-                    func_obj.keyword_value()
-                case OpCode.NEGATION:
-                    func_obj.negate()
-                case OpCode.NOT:
-                    func_obj.Not()
-                case OpCode.STRING | OpCode.IDENTIFIER | OpCode.NUMBER:
-                    func_obj.push_next()
-                case OpCode.PRINT | OpCode.PRINTLN:
-                    func_obj.print()
-                case OpCode.CLRSCRN:
-                    os.system('clear')    
-                case OpCode.RESOLVE:
-                    func_obj.resolve()
-                case OpCode.ASSIGNMENT:
-                    func_obj.assignment()
-                case OpCode.LIST:
-                    func_obj.list()
-                case OpCode.JUMP_FALSE:
-                    func_obj.jump_false()
-                case OpCode.JUMP:
-                    func_obj.jump()
-                case OpCode.LOOP:
-                    func_obj.loop()
-                case OpCode.CALL:
-                    func_name, func_args = func_obj.call()
-                    ret_value = self.run_stack_frame(func_name, func_args)
+    def run_stack_frame_profiled(self, func_name: str):
+        # Same as `run_stack_frame`, plus the bookkeeping for the profiler. Kept as
+        # a separate loop so that running without a profiler pays nothing for it.
+        profiler = self.profiler
+        opcode_counts = profiler.opcode_counts
+        func_obj = self.push_frame(self.main_declaration(func_name), [], 0)
+        profiler.enter(func_name)
+        frames = []
+
+        dispatch_table = self.dispatch_table
+        memo_caches = self.memo_caches
+        code_segment = func_obj.code_segment
+        call = OpCode.CALL
+        tail_call = OpCode.TAIL_CALL
+        ret = OpCode.RET
+        try:
+            while True:
+                op = code_segment[func_obj.ip]
+                opcode_counts[op] += 1
+                if op == call:
+                    ip = func_obj.ip
+                    callee = code_segment[ip + 1]
+                    arg_count = code_segment[ip + 2]
+                    profiler.call_site(self.call_trace_stack[-1], ip, callee.name)
+                    func_obj.ip = ip + 2
+                    cache = memo_caches.get(callee.name)
+                    key = None
+                    if cache is not None:
+                        key, ret_value = self.memo_lookup(cache, func_obj.operand_stack, arg_count)
+                        if ret_value is not MISS:
+                            func_obj.operand_stack.append(ret_value)
+                            func_obj.ip += 1
+                            continue
+                    frames.append(func_obj)
+                    func_obj = self.push_frame(callee, func_obj.operand_stack, arg_count)
+                    if key is not None:
+                        func_obj.memo = (cache, key)
+                    profiler.enter(callee.name)
+                    code_segment = func_obj.code_segment
+                    continue
+                if op == tail_call:
+                    ip = func_obj.ip
+                    callee = code_segment[ip + 1]
+                    arg_count = code_segment[ip + 2]
+                    profiler.call_site(self.call_trace_stack[-1], ip, callee.name)
+                    cache = memo_caches.get(callee.name)
+                    key = None
+                    ret_value = MISS
+                    if cache is not None:
+                        key, ret_value = self.memo_lookup(cache, func_obj.operand_stack, arg_count)
+                    if ret_value is MISS:
+                        self.tail_call(func_obj, callee, arg_count)
+                        if func_obj.memo is None and key is not None:
+                            func_obj.memo = (cache, key)
+                        profiler.leave()
+                        profiler.enter(callee.name)
+                        code_segment = func_obj.code_segment
+                        continue
                     func_obj.operand_stack.append(ret_value)
-                case OpCode.SLEEP:
-                    func_obj.sleep()
-                case OpCode.APPEND:
-                    func_obj.append()
-                case OpCode.RET:
-                    return func_obj.ret()
+                    op = ret
+                if op == ret:
+                    ret_value = self.pop_frame(func_obj)
+                    if func_obj.memo is not None:
+                        cache, key = func_obj.memo
+                        cache.store(key, ret_value)
+                    profiler.leave()
+                    if not frames:
+                        return ret_value
+                    func_obj = frames.pop()
+                    code_segment = func_obj.code_segment
+                    func_obj.operand_stack.append(ret_value)
+                else:
+                    dispatch_table[op](func_obj)
+                func_obj.ip += 1
+        except RuntimeError:
+            self.add_inlined_frames(frames, func_obj)
+            raise
+
+def copy_template(template: list):
+    """Copies a constant list literal, giving each evaluation its own nested lists."""
+    return ListValue([copy_template(item) if isinstance(item, list) else item for item in template])
 
-            func_obj.inc_pointer(1)
+def compare(op):
+    def compare_numbers(a, b):
+        if type(a) in number_types and type(b) in number_types:
+            return compare_op(a, b)
+        return comparision(a, b, op)
+    number_types = {int, float}
+    compare_op = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le}[op]
+    return compare_numbers
 
+# Comparison functions for the fused compare-and-jump instructions.
+COMPARISONS = {
+    OpCode.EQUAL_EQUAL:   operator.eq,
+    OpCode.GREATER:       compare('>'),
+    OpCode.GREATER_EQUAL: compare('>='),
+    OpCode.LESS:          compare('<'),
+    OpCode.LESS_EQUAL:    compare('<='),
+}
 
 def comparision(a, b, op):
-    if not (isinstance(a, float) and isinstance(b, float)):
-        raise RuntimeError(f"Can't compare instance of type `{type(a).__name__}` to type `{type(b).__name__}`.")
+    if not (is_number(a) and is_number(b)):
+        raise RuntimeError(f"Can't compare instance of type `{type_name(a)}` to type `{type_name(b)}`.")
     match op:
         case '>': 
             return a > b
@@ -317,37 +912,65 @@ def comparision(a, b, op):
         case '<=': 
             return a <= b
 
+def as_float(value) -> float:
+    """`value` as a float. Ints too big for one become the infinity a float would
+    have overflowed to."""
+    try:
+        return float(value)
+    except OverflowError:
+        return math.inf if value > 0 else -math.inf
+
+# Exact ints only overflow when they meet a float or are divided; the arithmetic
+# below then carries on in floats, as if the ints had been floats all along.
+
 def add(a, b):
     if isinstance(a, str) and isinstance(b, str):
         return a + b
-    if isinstance(a, float) and isinstance(b, float):
-        return a + b
+    if is_number(a) and is_number(b):
+        try:
+            return a + b
+        except OverflowError:
+            return as_float(a) + as_float(b)
     
-    raise RuntimeError(f"Can't add instance of type `{type(a).__name__}` to type `{type(b).__name__}`.")
+    raise RuntimeError(f"Can't add instance of type `{type_name(a)}` to type `{type_name(b)}`.")
 
 def sub(a, b):
-    if isinstance(a, float) and isinstance(b, float):
-        return a - b
-    raise RuntimeError(f"Can't subtract instance of type `{type(a).__name__}` to type `{type(b).__name__}`.")
+    if is_number(a) and is_number(b):
+        try:
+            return a - b
+        except OverflowError:
+            return as_float(a) - as_float(b)
+    raise RuntimeError(f"Can't subtract instance of type `{type_name(a)}` to type `{type_name(b)}`.")
 
 def mul(a, b):
-    if isinstance(a, float) and isinstance(b, float):
-        return a * b
-    raise RuntimeError(f"Can't mutilply instance of type `{type(a).__name__}` to type `{type(b).__name__}`.")
+    if is_number(a) and is_number(b):
+        try:
+            return a * b
+        except OverflowError:
+            return as_float(a) * as_float(b)
+    raise RuntimeError(f"Can't mutilply instance of type `{type_name(a)}` to type `{type_name(b)}`.")
 
 def div(a, b):
-    if isinstance(a, float) and isinstance(b, float):
+    if is_number(a) and is_number(b):
         if b == 0:
             raise RuntimeError('Division by zero error.')
-        return a / b
-    raise RuntimeError(f"Can't divide instance of type `{type(a).__name__}` to type `{type(b).__name__}`.")
+        try:
+            return a / b
+        except OverflowError:
+            return as_float(a) / as_float(b)
+    raise RuntimeError(f"Can't divide instance of type `{type_name(a)}` to type `{type_name(b)}`.")
     
 def mod(a, b):
-    if isinstance(a, float) and isinstance(b, float):
-        return a % b
-    raise RuntimeError(f"Can't modulo instance of type `{type(a).__name__}` to type `{type(b).__name__}`.")
+    if is_number(a) and is_number(b):
+        if b == 0:
+            raise RuntimeError('Division by zero error.')
+        try:
+            return a % b
+        except OverflowError:
+            return as_float(a) % as_float(b)
+    raise RuntimeError(f"Can't modulo instance of type `{type_name(a)}` to type `{type_name(b)}`.")
 
 def negate(a):
-    if isinstance(a, float):
+    if is_number(a):
         return -a
-    raise RuntimeError(f"Can't negate instance of type `{type(a).__name__}`.")
\ No newline at end of file
+    raise RuntimeError(f"Can't negate instance of type `{type_name(a)}`.")
\ No newline at end of file